@@ -0,0 +1,374 @@
+# Reproducible, offline benchmark of the updater on Linux.
+#
+# Everything the installer talks to is stood up locally in a throwaway folder:
+#   - a git repo with a tiny app, served over HTTP by dulwich's web server
+#   - a PEP 503 simple index of synthetic wheels, plus one large "torch-like" wheel, served by a range-capable HTTP
+#     server (so the segmented/resumable downloader is exercised)
+#   - a venv for the installed packages, which sees this interpreter's packages (Qt, dulwich...) through a .pth file
+# install.py is then run headlessly (Qt offscreen) through these scenarios:
+#   cold_install        nothing installed yet: clone, download the big wheel, install everything
+#   noop_launch         nothing changed: the launch fast path
+#   small_update        one file and one package version changed
+#   interrupted_resume  the big wheel changes, the first run is killed partway through its download, the second
+#                       run resumes it
+# Wall time of every run is reported along with the phases install.py recorded in logs/timings.jsonl.
+#
+# --installer uv runs the same scenarios with uv as the installer backend (uv has to be on the PATH).
+#
+# Usage: python benchmarks/benchmark.py [--torch-size-mb 200] [--packages 5] [--installer pip] [--output results.json] [--keep]
+import argparse
+import base64
+import functools
+import hashlib
+import http.server
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import threading
+import time
+import zipfile
+
+repoRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+torchLikeName = "benchtorch"
+
+def record_hash(data:bytes) -> str:
+    return "sha256=" + base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b"=").decode("ascii")
+
+def build_wheel(directory, name, version, payloadSize=0) -> str:
+    # A minimal but valid pure-python wheel. payloadSize adds an incompressible data file, stored uncompressed.
+    moduleName = name.replace("-", "_")
+    filename = f"{moduleName}-{version}-py3-none-any.whl"
+    distInfo = f"{moduleName}-{version}.dist-info"
+    files = {
+        f"{moduleName}/__init__.py": f"__version__ = \"{version}\"\n".encode("utf-8"),
+        f"{distInfo}/METADATA": f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n".encode("utf-8"),
+        f"{distInfo}/WHEEL": b"Wheel-Version: 1.0\nGenerator: benchmark\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+    }
+    record = []
+    with zipfile.ZipFile(os.path.join(directory, filename), 'w', zipfile.ZIP_STORED) as wheel:
+        for path, data in files.items():
+            wheel.writestr(path, data)
+            record.append(f"{path},{record_hash(data)},{len(data)}")
+        if payloadSize > 0:
+            payloadPath = f"{moduleName}/payload.bin"
+            payloadHash = hashlib.sha256()
+            with wheel.open(payloadPath, 'w', force_zip64=True) as payload:
+                written = 0
+                while written < payloadSize:
+                    chunk = os.urandom(min(1024 * 1024 * 4, payloadSize - written))
+                    payload.write(chunk)
+                    payloadHash.update(chunk)
+                    written += len(chunk)
+            record.append(f"{payloadPath},sha256={base64.urlsafe_b64encode(payloadHash.digest()).rstrip(b'=').decode('ascii')},{payloadSize}")
+        record.append(f"{distInfo}/RECORD,,")
+        wheel.writestr(f"{distInfo}/RECORD", "\n".join(record) + "\n")
+    return filename
+
+def write_simple_index(indexDir, filesDir):
+    # PEP 503: one page listing the projects, one page per project linking its files with their sha256.
+    projects = {}
+    for filename in sorted(os.listdir(filesDir)):
+        projectName = re.sub(r"[-_.]+", "-", filename.split("-")[0]).lower()
+        projects.setdefault(projectName, []).append(filename)
+    shutil.rmtree(indexDir, ignore_errors=True)
+    os.makedirs(indexDir)
+    with open(os.path.join(indexDir, "index.html"), 'w') as f:
+        f.write("<html><body>\n" + "".join(f'<a href="{name}/">{name}</a>\n' for name in projects) + "</body></html>\n")
+    for projectName, filenames in projects.items():
+        os.makedirs(os.path.join(indexDir, projectName))
+        links = []
+        for filename in filenames:
+            sha256 = hashlib.sha256()
+            with open(os.path.join(filesDir, filename), 'rb') as wheel:
+                for block in iter(lambda: wheel.read(1024 * 1024), b""):
+                    sha256.update(block)
+            sha256 = sha256.hexdigest()
+            links.append(f'<a href="../../files/{filename}#sha256={sha256}">{filename}</a>\n')
+        with open(os.path.join(indexDir, projectName, "index.html"), 'w') as f:
+            f.write("<html><body>\n" + "".join(links) + "</body></html>\n")
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # Static files with single-range support, which is all the downloader asks for.
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) or not os.path.exists(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        file = open(path, 'rb')
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match is None:
+            self.send_response(200)
+            start, end = 0, size - 1
+        else:
+            start, end = int(match.group(1)), min(int(match.group(2) or size - 1), size - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        file.seek(start)
+        self.remaining = end - start + 1
+        return file
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, "remaining", None)
+        if remaining is None:
+            return super().copyfile(source, outputfile)
+        while remaining > 0:
+            data = source.read(min(1024 * 64, remaining))
+            if not data:
+                break
+            outputfile.write(data)
+            remaining -= len(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class QuietHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Killing the installer mid-download drops its connections, that's expected here.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def start_http_server(directory) -> int:
+    server = QuietHTTPServer(("127.0.0.1", 0), functools.partial(RangeRequestHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+def start_git_server(repoDir) -> int:
+    from dulwich.repo import Repo
+    from dulwich.server import DictBackend
+    from dulwich.web import make_wsgi_chain, make_server, WSGIRequestHandlerLogger, WSGIServerLogger
+    import logging
+    logging.getLogger("dulwich").setLevel(logging.WARNING)
+    app = make_wsgi_chain(DictBackend({"/": Repo(repoDir)}))
+    server = make_server("127.0.0.1", 0, app, handler_class=WSGIRequestHandlerLogger, server_class=WSGIServerLogger)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+def commit_app(repoDir, files:dict, message):
+    from dulwich import porcelain
+    for path, content in files.items():
+        with open(os.path.join(repoDir, path), 'w') as f:
+            f.write(content)
+    porcelain.add(repoDir, paths=[os.path.join(repoDir, path) for path in files])
+    porcelain.commit(repoDir, message=message.encode("utf-8"), author=b"bench <bench@localhost>", committer=b"bench <bench@localhost>")
+
+def requirements_text(packageVersions:dict) -> str:
+    return "".join(f"{name}=={version}\n" for name, version in packageVersions.items())
+
+def create_venv(venvDir) -> str:
+    # The installed packages go here instead of into whatever venv runs the benchmark. The .pth file makes this
+    # interpreter's own packages (PyQt6, dulwich, requests...) importable from it.
+    subprocess.run([sys.executable, "-m", "venv", venvDir], check=True)
+    venvPython = os.path.join(venvDir, "bin", "python")
+    venvSitePackages = subprocess.run([venvPython, "-c", "import sysconfig; print(sysconfig.get_path('purelib'))"],
+                                      check=True, capture_output=True, text=True).stdout.strip()
+    with open(os.path.join(venvSitePackages, "benchmark-host-packages.pth"), 'w') as f:
+        f.write("\n".join(sorted({sysconfig.get_path("purelib"), sysconfig.get_path("platlib")})) + "\n")
+    return venvPython
+
+class Workspace:
+    def __init__(self, root, torchSizeMb, packageCount, installer="pip"):
+        self.root = root
+        self.installer = installer
+        self.torchSize = torchSizeMb * 1024 * 1024
+        self.filesDir = os.path.join(root, "server", "files")
+        self.remoteDir = os.path.join(root, "remote")
+        self.installDir = os.path.join(root, "install")
+        self.packageVersions = {f"benchpkg-{chr(ord('a') + i)}": "1.0" for i in range(packageCount)}
+        self.torchVersion = "1.0"
+
+    def publish_wheel(self, name, version, payloadSize=0):
+        build_wheel(self.filesDir, name, version, payloadSize)
+        write_simple_index(os.path.join(self.root, "server", "simple"), self.filesDir)
+
+    def setup(self):
+        from dulwich import porcelain
+        os.makedirs(self.filesDir)
+        os.makedirs(self.remoteDir)
+        os.makedirs(self.installDir)
+        print(f"Building {len(self.packageVersions)} wheels and a {self.torchSize // 1024 // 1024} MB one...")
+        for name, version in self.packageVersions.items():
+            build_wheel(self.filesDir, name, version)
+        self.publish_wheel(torchLikeName, self.torchVersion, self.torchSize)
+        self.indexPort = start_http_server(os.path.join(self.root, "server"))
+
+        porcelain.init(self.remoteDir)
+        commit_app(self.remoteDir, {
+            "main.py": "print('benchmark app started')\n",
+            "requirements.txt": requirements_text(self.packageVersions),
+            "requirements-torch.txt": f"{torchLikeName}=={self.torchVersion}\n",
+        }, "Initial version")
+        self.gitPort = start_git_server(self.remoteDir)
+
+        print("Creating the benchmark venv...")
+        self.python = create_venv(os.path.join(self.root, "venv"))
+        for filename in ["install.py", "install_ui.py"]:
+            shutil.copy(os.path.join(repoRoot, filename), self.installDir)
+        self.write_repo_json()
+
+    def write_repo_json(self, **extra):
+        settings = {"repo_url": f"http://127.0.0.1:{self.gitPort}/", "repo_dir": "App", "startup_script": "main.py",
+                    "venv_folder": "venv", "installer": self.installer, **extra}
+        if self.installer == "uv":
+            settings["uv_path"] = shutil.which("uv")
+        with open(os.path.join(self.installDir, "repo.json"), 'w') as f:
+            json.dump(settings, f, indent=2)
+
+    def environment(self) -> dict:
+        env = {name: value for name, value in os.environ.items() if not name.startswith(("PIP_", "UV_"))}
+        env.update({
+            "QT_QPA_PLATFORM": "offscreen",
+            "LANG": "en_US.UTF-8",
+            "LC_ALL": "en_US.UTF-8",
+            "PIP_INDEX_URL": f"http://127.0.0.1:{self.indexPort}/simple/",
+            "PIP_NO_CACHE_DIR": "1",
+            "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+            # uv doesn't read pip's settings.
+            "UV_INDEX_URL": f"http://127.0.0.1:{self.indexPort}/simple/",
+            "UV_NO_CACHE": "1",
+        })
+        return env
+
+    def start_installer(self) -> subprocess.Popen:
+        return subprocess.Popen([self.python, "install.py"], cwd=self.installDir, env=self.environment(),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True)
+
+    def timing_records(self, fromLine) -> list:
+        path = os.path.join(self.installDir, "logs", "timings.jsonl")
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r') as f:
+            return [json.loads(line) for line in f.readlines()[fromLine:] if line.strip()]
+
+    def timing_line_count(self) -> int:
+        path = os.path.join(self.installDir, "logs", "timings.jsonl")
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'r') as f:
+            return sum(1 for _ in f)
+
+    def run_installer(self, scenario) -> dict:
+        fromLine = self.timing_line_count()
+        start = time.perf_counter()
+        process = self.start_installer()
+        _, stderr = process.communicate(timeout=1800)
+        wallMs = (time.perf_counter() - start) * 1000
+        if process.returncode != 0:
+            raise RuntimeError(f"{scenario}: install.py exited with {process.returncode}\n{stderr.decode('utf-8', errors='replace')}")
+        return self.result(scenario, wallMs, self.timing_records(fromLine))
+
+    def result(self, scenario, wallMs, records) -> dict:
+        phases = {}
+        for record in records:
+            phase = phases.setdefault(record["phase"], {"count": 0, "duration_ms": 0})
+            phase["count"] += 1
+            phase["duration_ms"] = round(phase["duration_ms"] + record["duration_ms"], 1)
+            for field in ["bytes", "resumed_bytes", "cache_hits"]:
+                if record.get(field):
+                    phase[field] = phase.get(field, 0) + record[field]
+        return {"scenario": scenario, "wall_ms": round(wallMs, 1), "phases": phases}
+
+    def cold_install(self) -> dict:
+        return self.run_installer("cold_install")
+
+    def noop_launch(self) -> dict:
+        return self.run_installer("noop_launch")
+
+    def small_update(self) -> dict:
+        firstPackage = next(iter(self.packageVersions))
+        self.packageVersions[firstPackage] = "1.1"
+        self.publish_wheel(firstPackage, "1.1")
+        commit_app(self.remoteDir, {
+            "main.py": "print('benchmark app started, version 2')\n",
+            "requirements.txt": requirements_text(self.packageVersions),
+        }, "Small update")
+        return self.run_installer("small_update")
+
+    def interrupted_resume(self) -> dict:
+        self.torchVersion = "1.1"
+        self.publish_wheel(torchLikeName, self.torchVersion, self.torchSize)
+        commit_app(self.remoteDir, {"requirements-torch.txt": f"{torchLikeName}=={self.torchVersion}\n"}, "New big wheel")
+
+        # Slow the first run down so there's a download to interrupt (about 8 seconds for the whole file), and kill it
+        # once the manifest says a good part of it is on disk.
+        self.write_repo_json(download_limit_kbps=max(1, self.torchSize // 1024 // 8))
+        manifestPath = os.path.join(self.installDir, "wheelhouse", f"{torchLikeName}-{self.torchVersion}-py3-none-any.whl.part.download.json")
+        fromLine = self.timing_line_count()
+        start = time.perf_counter()
+        process = self.start_installer()
+        interruptedAt = 0
+        while process.poll() is None and time.perf_counter() - start < 600:
+            try:
+                with open(manifestPath, 'r') as f:
+                    manifest = json.load(f)
+                interruptedAt = sum(segment[2] for segment in manifest["segments"])
+            except (OSError, ValueError, KeyError):
+                interruptedAt = 0
+            if interruptedAt >= self.torchSize * 0.3:
+                os.killpg(process.pid, signal.SIGKILL)
+                break
+            time.sleep(0.2)
+        process.wait()
+        firstRunMs = (time.perf_counter() - start) * 1000
+        if interruptedAt == 0:
+            raise RuntimeError("interrupted_resume: the download finished before it could be interrupted")
+
+        self.write_repo_json()
+        result = self.run_installer("interrupted_resume")
+        result["interrupted_run_ms"] = round(firstRunMs, 1)
+        result["interrupted_at_bytes"] = interruptedAt
+        result["phases_before_interruption"] = self.result("", 0, self.timing_records(fromLine))["phases"]
+        return result
+
+def print_results(results:list):
+    for result in results:
+        print(f"\n{result['scenario']}: {result['wall_ms']:.0f} ms")
+        if "interrupted_at_bytes" in result:
+            print(f"  (first run killed after {result['interrupted_run_ms']:.0f} ms with "
+                  f"{result['interrupted_at_bytes'] / 1024 / 1024:.1f} MB downloaded)")
+        for phase, stats in sorted(result["phases"].items(), key=lambda item: -item[1]["duration_ms"]):
+            extra = "".join(f"  {field}={stats[field]}" for field in ["bytes", "resumed_bytes", "cache_hits"] if field in stats)
+            print(f"  {phase:<24}{stats['duration_ms']:>10.0f} ms  x{stats['count']}{extra}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of install.py's update paths.")
+    parser.add_argument("--torch-size-mb", type=int, default=200, help="size of the large torch-like wheel")
+    parser.add_argument("--packages", type=int, default=5, help="number of small synthetic packages")
+    parser.add_argument("--installer", choices=["pip", "uv"], default="pip", help="installer backend to benchmark")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary workspace")
+    args = parser.parse_args()
+    if args.installer == "uv" and shutil.which("uv") is None:
+        parser.error("--installer uv needs uv on the PATH")
+
+    root = tempfile.mkdtemp(prefix="installer-benchmark-")
+    try:
+        workspace = Workspace(root, args.torch_size_mb, args.packages, args.installer)
+        workspace.setup()
+        results = []
+        for scenario in [workspace.cold_install, workspace.noop_launch, workspace.small_update, workspace.interrupted_resume]:
+            print(f"Running {scenario.__name__}...")
+            results.append(scenario())
+        print_results(results)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({"torch_size_mb": args.torch_size_mb, "packages": args.packages, "installer": args.installer, "results": results}, f, indent=2)
+    finally:
+        if args.keep:
+            print(f"\nWorkspace kept in {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
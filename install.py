@@ -1,22 +1,54 @@
+import functools
+import hashlib
+import importlib.util
 import io
 import json
 import locale
 import logging
+import logging.handlers
+import math
 import os
+import re
+import shutil
 import sys
 import threading
 import subprocess
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+launchStartTime = time.perf_counter()
+
+# install_ui imports its helpers from this module by name. Make sure that resolves to the running script,
+# rather than importing (and running) a second copy of it.
+if __name__ == "__main__":
+    sys.modules.setdefault("install", sys.modules[__name__])
 
 baserequirements = [
     "requests",
     "googletrans~=4.0.0rc1",
     "PyQt6",
     "PyQt6-Qt6",
-    "dulwich~=0.21.5"
+    "dulwich~=0.21.5",
+    "packaging"
 ]
 
 logsDir = "logs"
+requirementsStateFile = "requirements-state.json"
+translationCacheFile = "translations.json"
+remoteStateFile = "remote-state.json"
+timingsFile = "timings.jsonl"
+locksDir = "locks"
+appOutputLogFile = "app-output.log"
+stagedUpdateJournal = "staged-update.json"
+rollbackPinFile = "rollback-pin.json"
+backgroundUpdateStateFile = "background-update.json"
+updateSourceDir = "update-source"
+updateSourceStateFile = "update-source.json"
+bundleManifestFile = "bundle.json"
+
+# Exit code telling launcher.go to start the app through "install.py --watchdog" (see handoff_to_watchdog).
+watchdogExitCode = 98
 
 if not os.path.exists(logsDir):
     os.makedirs(logsDir)
@@ -36,20 +68,257 @@ error_handler.setFormatter(formatter)
 logger.addHandler(debug_handler)
 logger.addHandler(error_handler)
 
+repoData = json.load(open("repo.json"))
+
+# Timing records: every phase of a run appends one JSON line to logs/timings.jsonl, which "install.py timing-report"
+# summarizes across runs. Records of the same run share runId.
+runId = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+timingsMaxSize = 1024 * 1024 * 5
+timingsLock = threading.Lock()
+spanStack = threading.local()
+
+def record_timing(phase, durationMs, **fields):
+    record = {"run": runId, "time": round(time.time(), 3), "phase": phase, "duration_ms": round(durationMs, 1), **fields}
+    path = os.path.join(logsDir, timingsFile)
+    try:
+        with timingsLock:
+            if os.path.exists(path) and os.path.getsize(path) > timingsMaxSize:
+                os.replace(path, path + ".1")
+            with open(path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        logger.debug(f"Could not write the timing record for {phase}: {e}")
+
+class Span:
+    # Times a block and records it when it ends, along with any fields set on it in the meantime (bytes, cache hits...).
+    # Code running inside the block can reach it through current_span().
+    def __init__(self, phase, **fields):
+        self.phase = phase
+        self.fields = fields
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def add(self, **counters):
+        for name, amount in counters.items():
+            self.fields[name] = self.fields.get(name, 0) + amount
+
+    def __enter__(self):
+        if not hasattr(spanStack, "spans"):
+            spanStack.spans = []
+        spanStack.spans.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        spanStack.spans.remove(self)
+        self.fields.setdefault("ok", excType is None)
+        record_timing(self.phase, (time.perf_counter() - self.start) * 1000, **self.fields)
+        return False
+
+def current_span() -> Span:
+    # The innermost open span of this thread. Outside of any, a throwaway one so callers don't need to check.
+    spans = getattr(spanStack, "spans", None)
+    return spans[-1] if spans else Span(None)
+
+def timed(phase):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Span(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
 subprocess_flags = 0
 if os.name == 'nt':  # Check if the operating system is Windows
     subprocess_flags = subprocess.CREATE_NO_WINDOW  # Prevent the command prompt from appearing on Windows
 
+# Windows has no niceness, map it onto the closest priority class instead.
+def get_priority_creationflags(niceness) -> int:
+    if os.name != "nt" or niceness <= 0:
+        return 0
+    if niceness >= 15:
+        return subprocess.IDLE_PRIORITY_CLASS
+    return subprocess.BELOW_NORMAL_PRIORITY_CLASS
+
+def pip_process_options() -> dict:
+    # Keyword arguments for every subprocess that runs pip: no console window, and on Windows the pip_niceness
+    # priority so builds don't hog the CPU. Children inherit it, so this covers compilers pip starts too.
+    return {"creationflags": subprocess_flags | get_priority_creationflags(repoData.get("pip_niceness", 0))}
+
+def nice_command(command:list) -> list:
+    # Elsewhere the niceness comes from running pip under nice. Setting it in the child with preexec_fn isn't safe
+    # while other threads are running, which they usually are here.
+    niceness = repoData.get("pip_niceness", 0)
+    if os.name == "nt" or niceness <= 0 or shutil.which("nice") is None:
+        return command
+    return ["nice", "-n", str(niceness), *command]
+
+class PipInstaller:
+    # Everything that installs, downloads or resolves packages goes through an installer, so which tool does the work
+    # is a repo.json setting. This one runs pip in the current interpreter, and is the default.
+    name = "pip"
+
+    def pip_command(self, *args) -> list:
+        return [sys.executable, '-m', 'pip', *args]
+
+    def install_flags(self, upgrade=True, offline=False, noDeps=False, requireHashes=False) -> list:
+        flags = []
+        if upgrade:
+            flags.append('--upgrade')
+        if offline:
+            flags.append('--no-index')
+        if noDeps:
+            flags.append('--no-deps')
+        if requireHashes:
+            flags.append('--require-hashes')
+        return flags
+
+    def install_command(self, args:list, deferCompile=True, **options) -> list:
+        # With precompile on, the bytecode is compiled in parallel afterwards instead (see start_precompile). Installs
+        # nothing gets queued for, like the prerequisites, pass deferCompile=False to have them compiled right away.
+        compileFlags = ['--no-compile'] if deferCompile and repoData.get("precompile", True) else []
+        return self.pip_command('install', *self.install_flags(**options), *compileFlags, *args)
+
+    def install(self, args:list, **options) -> subprocess.CompletedProcess:
+        return subprocess.run(nice_command(self.install_command(args, **options)), check=True, text=True, capture_output=True, **pip_process_options())
+
+    def install_with_progress(self, args:list, onProgress, **options) -> str:
+        # Like install, but calls onProgress(event, packageName) while the output comes in. The events are
+        # "collecting" (with the package name) and "installing". Returns the output.
+        output = []
+        process = subprocess.Popen(nice_command(self.install_command(args, **options)),
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   text=True,
+                                   **pip_process_options())
+        for line in process.stdout:
+            output.append(line)
+            event = self.parse_progress(line.strip())
+            if event is not None:
+                onProgress(*event)
+        process.wait()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, process.args, output="".join(output))
+        return "".join(output)
+
+    def parse_progress(self, line:str):
+        if line.startswith("Collecting ") or line.startswith("Requirement already satisfied: "):
+            return "collecting", get_package_name(line.split(" ", 1)[1].split(": ", 1)[-1])
+        if line.startswith("Installing collected packages"):
+            return "installing", None
+        return None
+
+    def download(self, dest, args:list) -> subprocess.CompletedProcess:
+        return subprocess.run(nice_command(self.pip_command('download', '--dest', dest, *args)), check=True, text=True, capture_output=True, **pip_process_options())
+
+    def report(self, args:list) -> subprocess.CompletedProcess:
+        # A dry run that prints pip's JSON install report. Doesn't raise, the caller looks at the return code.
+        # pip needs every wheel's metadata for it. Unless the index serves that separately (PEP 658), pip would fetch
+        # the whole wheel, which for pytorch means gigabytes downloaded twice. fast-deps has it read just the metadata
+        # out of the wheel with HTTP range requests instead (pip 23.3 and newer skip the download in dry runs then).
+        command = self.pip_command('install', '--dry-run', '--quiet', '--report', '-', '--use-feature=fast-deps', *args)
+        completed_process = subprocess.run(nice_command(command), text=True, capture_output=True, **pip_process_options())
+        if completed_process.returncode != 0 and "fast-deps" in completed_process.stderr:
+            # A pip that doesn't know the feature (anymore).
+            command.remove('--use-feature=fast-deps')
+            completed_process = subprocess.run(nice_command(command), text=True, capture_output=True, **pip_process_options())
+        return completed_process
+
+class UvInstaller(PipInstaller):
+    # uv's pip interface: a much faster resolver, and wheels are downloaded and unpacked in parallel.
+    # It has no "pip download" or install reports, so those still go through pip.
+    name = "uv"
+
+    def __init__(self, executable):
+        self.executable = executable
+
+    def install_command(self, args:list, deferCompile=True, **options) -> list:
+        # uv keeps its own store of unpacked wheels. With a package store, that's kept in there and hardlinked from.
+        # The prerequisites get installed while this module is still loading, before packageStore exists.
+        store = globals().get("packageStore")
+        storeArgs = ['--cache-dir', os.path.join(store.directory, "uv-cache"), '--link-mode', 'hardlink'] if store is not None else []
+        # uv doesn't compile anything unless asked to.
+        compileFlags = [] if deferCompile else ['--compile-bytecode']
+        return [self.executable, 'pip', 'install', '--python', sys.executable, *storeArgs, *self.install_flags(**options), *compileFlags, *args]
+
+    def parse_progress(self, line:str):
+        # uv only lists what it changed, once it's done: " + name==version".
+        if line.startswith("Resolved ") or line.startswith("Prepared "):
+            return "installing", None
+        if line.startswith("+ "):
+            return "collecting", get_package_name(line[2:])
+        return None
+
+def find_uv():
+    # uv_path from repo.json, else in the venv, next to the portable Python the venv was made from, or on the PATH.
+    if "uv_path" in repoData:
+        return repoData["uv_path"] if os.path.isfile(repoData["uv_path"]) else None
+    exeName = "uv.exe" if os.name == "nt" else "uv"
+    for folder in [os.path.dirname(sys.executable), sys.base_prefix, os.path.join(sys.base_prefix, "Scripts"), os.path.join(sys.base_prefix, "bin")]:
+        if os.path.isfile(os.path.join(folder, exeName)):
+            return os.path.join(folder, exeName)
+    return shutil.which(exeName)
+
+@functools.lru_cache(maxsize=None)
+def get_installer() -> PipInstaller:
+    choice = repoData.get("installer", "pip")
+    if choice in ("uv", "auto"):
+        uvPath = find_uv()
+        if uvPath is not None:
+            logger.debug(f"Using uv at {uvPath} as the installer.")
+            return UvInstaller(uvPath)
+        if choice == "uv":
+            logger.error("uv was selected as the installer but couldn't be found, using pip instead.")
+    return PipInstaller()
+
+def get_option_value(option, usage):
+    # The value following option on the command line, or None if the option isn't there at all.
+    if option not in sys.argv[1:]:
+        return None
+    index = sys.argv.index(option) + 1
+    if index >= len(sys.argv):
+        sys.stderr.write(f"Usage: {usage}\n")
+        sys.exit(2)
+    return sys.argv[index]
+
+def get_update_source():
+    # An exported update bundle (see export_bundle), or a folder it was extracted to, to update from instead of the
+    # network. --update-source on the command line takes precedence over update_source in repo.json.
+    return get_option_value("--update-source", "--update-source <bundle.zip or folder>") or repoData.get("update_source")
+
+def get_update_source_args() -> list:
+    # For the processes we start ourselves, so a --update-source given to this run applies to them too.
+    return ["--update-source", get_update_source()] if "--update-source" in sys.argv[1:] else []
+
+def get_repo_url() -> str:
+    # Where updates come from: the remote repository, or the copy of it inside the update bundle.
+    updateSource = get_update_source()
+    if not updateSource:
+        return repoData["repo_url"]
+    if os.path.isdir(updateSource):
+        return os.path.abspath(os.path.join(updateSource, "repo.git"))
+    return os.path.abspath(os.path.join(updateSourceDir, "repo.git"))
+
+def get_base_wheels_dir(updateSource) -> str:
+    # The bundle's wheels for the base requirements, as a folder pip can use. Archives get them extracted first.
+    if os.path.isdir(updateSource):
+        return os.path.join(updateSource, "base-wheels")
+    import zipfile
+    with zipfile.ZipFile(updateSource) as archive:
+        for member in archive.namelist():
+            if member.startswith("base-wheels/"):
+                archive.extract(member, updateSourceDir)
+    return os.path.join(updateSourceDir, "base-wheels")
+
 def install_base_requirements(installDoneEvent:threading.Event):
     try:
-        pipargs = [sys.executable, '-m', 'pip', 'install', '--upgrade']
-        pipargs.extend(baserequirements)
-
-        completed_process = subprocess.run(pipargs,
-                                           check=True,
-                                           text=True,
-                                           capture_output=True,
-                                           creationflags=subprocess_flags)
+        sourceArgs = []
+        if get_update_source():
+            sourceArgs = ['--no-index', '--find-links', get_base_wheels_dir(get_update_source())]
+        # Nothing precompiles the prerequisites later, so pip compiles them as it installs them.
+        completed_process = get_installer().install([*sourceArgs, *baserequirements], deferCompile=False)
 
         logger.debug(completed_process.stdout)
         if completed_process.stderr:
@@ -58,23 +327,23 @@ def install_base_requirements(installDoneEvent:threading.Event):
         logger.debug("Done installing packages, exiting...")
     except subprocess.CalledProcessError as e:
         logger.error(f"Failed to install packages: {e.stdout} {e.stderr}")
+    except Exception as e:
+        logger.exception(e)
     finally:
         # Close the messagebox when done
         installDoneEvent.set()
 
+# Only check that the prerequisites are there - actually importing them (Qt especially) is slow, so that waits until
+# something needs them. Launches with nothing to update never import Qt, requests or googletrans at all.
+prerequisiteModules = ["googletrans", "PyQt6", "dulwich", "requests", "packaging"]
+
 logger.debug("Checking prerequisites...")
-try:
-    import googletrans
-    from PyQt6 import QtWidgets, QtCore, QtGui
-    import dulwich
-    from dulwich import porcelain, client, repo
-    import requests
-except ModuleNotFoundError as e:
+missingPrerequisites = [module for module in prerequisiteModules if importlib.util.find_spec(module) is None]
+if len(missingPrerequisites) > 0:
     #Prerequisite not found, need to install the base requirements
-    logger.debug(f"Base requirements missing {e}, installing...")
+    logger.debug(f"Base requirements missing {missingPrerequisites}, installing...")
     import tkinter as tk
     from tkinter import messagebox
-    import importlib
 
     root = tk.Tk()
     root.withdraw()  # Hide the main window
@@ -104,123 +373,125 @@ except ModuleNotFoundError as e:
     logger.debug("Also, creating the 'installing' file, as I'm gonna go ahead and assume we need to do some cleanup.")
     open("installing", 'w').close()
     exit(99)
-except ImportError as e:
-    logger.debug(f"{e}: Some other bug happened!")
-    exit(99)
 logger.debug("Prerequisites found.")
-repoData = json.load(open("repo.json"))
-
-colors_dict = {
-    "primary_color":"#1A1D22",
-    "secondary_color":"#282C34",
-    "hover_color":"#596273",
-    "text_color":"#FFFFFF",
-    "toggle_color":"#4a708b",
-    "green":"#3a7a3a",
-    "yellow":"#7a7a3a",
-    "red":"#7a3a3a"
-}
-
-translator = googletrans.Translator()
-
-class SignalEmitter(QtCore.QObject):
-    signal = QtCore.pyqtSignal()
 
-class StrSignalEmitter(QtCore.QObject):
-    signal = QtCore.pyqtSignal(str)
+normalInstallText = "Updating packages"
+torchInstallText = "Updating pytorch, this may take a while...\nNote: The bar not moving is normal."
+installingText = "Installing downloaded packages"
+downloadingText = "Downloading"
+
+# Every string the UI can show. They all get translated together in one background request.
+uiStrings = [
+    normalInstallText,
+    torchInstallText,
+    installingText,
+    downloadingText,
+    "Confirmation",
+    "Are you sure you want to quit?",
+    "Update",
+    "Updating Github repository..."
+]
 
-class BoolSignalEmitter(QtCore.QObject):
-    signal = QtCore.pyqtSignal(bool)
+translationCache = None
+translationLock = threading.Lock()
+translationListeners = []
 
-class IntSignalEmitter(QtCore.QObject):
-    signal = QtCore.pyqtSignal(int)
+@functools.lru_cache(maxsize=None)
+def get_language_code() -> str:
+    try:
+        if os.name == "nt":
+            # windows-specific
+            import ctypes
+            windll = ctypes.windll.kernel32
+            langCode = locale.windows_locale[windll.GetUserDefaultUILanguage()]
+            if "_" in langCode:
+                langCode = langCode.split("_")[0]
+        else:
+            # macos or linux
+            langCode = locale.getdefaultlocale()[0].split("_")[0]
+    except (KeyError, AttributeError, TypeError):
+        logger.debug("Could not detect the UI language, assuming english.")
+        langCode = "en"
+    return langCode
+
+def load_translation_cache() -> dict:
+    global translationCache
+    with translationLock:
+        if translationCache is None:
+            translationCache = {}
+            if os.path.exists(translationCacheFile):
+                try:
+                    with open(translationCacheFile, 'r', encoding='utf-8') as f:
+                        translationCache = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Could not read {translationCacheFile}, ignoring it: {e}")
+        return translationCache
 
 def translate_ui_text(text):
+    # Never blocks: returns the cached translation, or the english text if it hasn't been translated yet.
+    # start_background_translation() fills the cache, and translationListeners get called once it has.
     if text is None or text == "":
         return text
 
-    if os.name == "nt":
-        # windows-specific
-        import ctypes
-        windll = ctypes.windll.kernel32
-        import locale
-        langCode = locale.windows_locale[windll.GetUserDefaultUILanguage()]
-        if "_" in langCode:
-            langCode = langCode.split("_")[0]
-    else:
-        # macos or linux
-        import locale
-        langCode = locale.getdefaultlocale()[0].split("_")[0]
+    langCode = get_language_code()
+    if "en" in langCode.lower():
+        return text
+
+    translatedText = load_translation_cache().get(langCode, {}).get(text)
+    return translatedText if translatedText is not None else text
 
+@timed("translate")
+def fetch_translations(texts, langCode):
+    import asyncio
+    import inspect
+    import googletrans
+    current_span().set(strings=len(texts), language=langCode)
     counter = 0
-    translatedText = None
+    translatedTexts = None
     while counter < 10:
         try:
-            if "en" in langCode.lower():
-                translatedText = text
-            else:
-                translatedText = translator.translate(text, dest=langCode).text
+            translations = googletrans.Translator().translate(texts, dest=langCode)
+            # Newer googletrans releases are async, there translate hands back a coroutine.
+            if inspect.iscoroutine(translations):
+                translations = asyncio.run(translations)
+            translatedTexts = [(text, translation.text.strip()) for text, translation in zip(texts, translations)]
             break
         except TypeError:
             counter += 1
-        except Exception:
-            logger.debug("Timeout error when trying to use google translate. Not going to translate.")
+        except Exception as e:
+            logger.debug(f"Error when trying to use google translate ({e}). Not going to translate.")
             break
 
-    if translatedText is None:
+    if translatedTexts is None:
         logger.error("Failed to get translation. Leaving it in english.")
-        translatedText = text
-        translatedText = translatedText[0].upper() + translatedText[1:]
-
-    if langCode not in ['ja', 'zh-cn', 'zh-tw']:  # Add more if needed
-        translatedText = translatedText[0].upper() + translatedText[1:]
-
-    translatedText = translatedText.strip()
-
-    return translatedText
-
-normalInstallText = translate_ui_text("Updating packages")
-torchInstallText = translate_ui_text("Updating pytorch, this may take a while...\nNote: The bar not moving is normal.")
-
-def get_stylesheet():
-    styleSheet = """
-    * {
-        background-color: {primary_color};
-        color: {secondary_color};
-    }
-    
-    QLabel {
-        color: {text_color};
-    }
-    
-    QMessageBox {
-        background-color: {primary_color};
-        color: {text_color};
-    }
-    
-    QProgressBar {
-            border: 0px solid {hover_color};
-            text-align: center;
-            background-color: {secondary_color};
-            color: {text_color};
-    }
-    QProgressBar::chunk {
-        background-color: {toggle_color};
-    }
-    
-    QPushButton {
-        background-color: {secondary_color};
-        color: {text_color};
-    }
-    
-    QPushButton:hover {
-        background-color: {hover_color};
-    }
-    """
-
-    for colorKey, colorValue in colors_dict.items():
-        styleSheet = styleSheet.replace("{" + colorKey + "}", colorValue)
-    return styleSheet
+        return
+
+    cache = load_translation_cache()
+    with translationLock:
+        languageCache = cache.setdefault(langCode, {})
+        for text, translatedText in translatedTexts:
+            if translatedText == "":
+                continue
+            if langCode not in ['ja', 'zh-cn', 'zh-tw']:  # Add more if needed
+                translatedText = translatedText[0].upper() + translatedText[1:]
+            languageCache[text] = translatedText
+        with open(translationCacheFile + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2, ensure_ascii=False)
+        os.replace(translationCacheFile + ".tmp", translationCacheFile)
+
+    logger.debug(f"Got {len(texts)} translations for {langCode}.")
+    for listener in translationListeners:
+        listener()
+
+def start_background_translation():
+    langCode = get_language_code()
+    if "en" in langCode.lower():
+        return
+    cached = load_translation_cache().get(langCode, {})
+    missing = [text for text in uiStrings if text not in cached]
+    if len(missing) == 0:
+        return
+    threading.Thread(target=fetch_translations, args=(missing, langCode), daemon=True).start()
 
 #Yes, a bunch of this code was done with GPT-4's help because I'm lazy like that.
 def format_eta(seconds) -> str:
@@ -233,389 +504,1956 @@ def format_eta(seconds) -> str:
     else:
         return f"{int(seconds)}s"
 
-class DownloadThread(QtCore.QThread):
-    setProgressBarTotalSignal = QtCore.pyqtSignal(int)
-    updateProgressSignal = QtCore.pyqtSignal(int)
-    labelTextSignal = QtCore.pyqtSignal(int)
-    doneSignal = QtCore.pyqtSignal()
+downloadChunkSize = 1024 * 16
+downloadManifestSuffix = ".download.json"
+
+class DownloadCancelled(Exception):
+    pass
+
+class TokenBucket:
+    # Caps throughput at rate bytes per second, shared by every connection that consumes from it. A rate of 0 means
+    # unlimited. The rate can be changed while downloads are running, it applies from the next chunk on.
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.tokens = 0
+        self.lastRefill = time.monotonic()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.tokens = min(self.tokens, rate)
+            self.lastRefill = time.monotonic()
+
+    def consume(self, amount, cancelEvent=None):
+        with self.lock:
+            if self.rate <= 0:
+                return
+            now = time.monotonic()
+            # Allow at most a second's worth of burst.
+            self.tokens = min(self.rate, self.tokens + (now - self.lastRefill) * self.rate)
+            self.lastRefill = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            if cancelEvent is not None:
+                cancelEvent.wait(wait)
+            else:
+                time.sleep(wait)
+
+# Every download goes through this. Foreground updates run at download_limit_kbps (unlimited by default), the
+# background updater lowers it to background_download_limit_kbps.
+downloadLimiter = TokenBucket(repoData.get("download_limit_kbps", 0) * 1024)
+
+class HashMismatch(Exception):
+    pass
 
-    def __init__(self, url, location):
-        super().__init__()
+def probe_download(url):
+    # Returns the size of the file and whether the server will let us fetch parts of it.
+    import requests
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=30)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logger.debug(f"HEAD request for {url} failed ({e}), falling back to a single stream.")
+        return None, False
+
+    size = response.headers.get('content-length')
+    supportsRanges = response.headers.get('accept-ranges', '').lower() == 'bytes'
+    return (int(size) if size is not None else None), supportsRanges
+
+class ResumableDownload:
+    # Downloads a file with several parallel HTTP Range requests, each one writing its own segment of a preallocated file.
+    # How much of every segment is done gets saved to a sidecar manifest, so a cancelled or interrupted download
+    # resumes where it stopped instead of starting from zero. Servers without range support get a single stream.
+    # The file is hashed while it downloads, and if it doesn't match expectedSha256 it gets fetched again.
+    minSegmentSize = 1024 * 1024 * 8
+    manifestSaveInterval = 2
+    maxAttempts = 3
+    maxHashAttempts = 2
+
+    def __init__(self, url, location, progressCallback=None, connections=None, cancelEvent=None, expectedSha256=None, rateLimiter=None):
         self.url = url
         self.location = location
+        self.expectedSha256 = expectedSha256
+        self.sha256 = None
+        self.manifestPath = location + downloadManifestSuffix
+        self.progressCallback = progressCallback
+        self.connections = connections if connections is not None else repoData.get("download_connections", 4)
+        self.cancelEvent = cancelEvent if cancelEvent is not None else threading.Event()
+        self.rateLimiter = rateLimiter if rateLimiter is not None else downloadLimiter
+        self.lock = threading.Lock()
+        self.size = None
+        self.segments = []  # [start, end (inclusive), bytes written]
+        self.received = 0
+        self.lastManifestSave = 0
+        self.dataWritten = threading.Event()
+        self.writersDone = threading.Event()
 
     def run(self):
-        response = requests.get(self.url, stream=True)
-        total_size_in_bytes = response.headers.get('content-length')
-
-        if total_size_in_bytes is None:  # If 'content-length' is not found in headers
-            self.setProgressBarTotalSignal.emit(-1)  # Set progress bar to indeterminate state
+        with Span("download", file=os.path.basename(self.location)) as span:
+            for attempt in range(self.maxHashAttempts):
+                self.download()
+                span.set(bytes=self.size, resumed_bytes=self.resumedBytes, attempts=attempt + 1)
+                if self.expectedSha256 is None or self.sha256 == self.expectedSha256:
+                    return
+                # Only this file gets fetched again, nothing else about the update has to start over.
+                logger.error(f"Hash mismatch for {self.location}: expected {self.expectedSha256}, got {self.sha256}. Downloading it again.")
+                os.remove(self.location)
+            raise HashMismatch(f"{os.path.basename(self.location)} does not match its expected sha256 hash.")
+
+    def download(self):
+        self.sha256 = None
+        self.resumedBytes = 0
+        self.size, supportsRanges = probe_download(self.url)
+        if self.size is None or not supportsRanges:
+            logger.debug("Server does not support ranged downloads, using a single stream.")
+            self.download_single_stream()
+            return
+
+        if not self.load_manifest():
+            segmentCount = max(1, min(self.connections, self.size // self.minSegmentSize))
+            segmentSize = self.size // segmentCount
+            self.segments = [[i * segmentSize, (i + 1) * segmentSize - 1, 0] for i in range(segmentCount)]
+            self.segments[-1][1] = self.size - 1
+            with open(self.location, 'wb') as file:
+                file.truncate(self.size)
+            self.save_manifest()
         else:
-            total_size_in_bytes = int(total_size_in_bytes)
-            self.setProgressBarTotalSignal.emit(total_size_in_bytes)
-
-        block_size = 1024 * 16
-        try:
-            response.raise_for_status()
-            file = open(self.location, 'wb')
+            logger.debug(f"Resuming download of {self.location}")
 
-            start_time = time.time()
-            total_data_received = 0
-            last_emit_time = start_time  # Initialize last_emit_time to start_time
-            data_received_since_last_emit = 0
-
-            for data in response.iter_content(block_size):
-                total_data_received += len(data)
-                data_received_since_last_emit += len(data)
+        self.received = sum(segment[2] for segment in self.segments)
+        self.resumedBytes = self.received
+        self.report_progress()
+        pending = [i for i, segment in enumerate(self.segments) if not self.is_segment_done(segment)]
+        logger.debug(f"Downloading {len(pending)} segments of {self.location} in parallel")
 
+        self.writersDone.clear()
+        hashThread = threading.Thread(target=self.hash_written_data, daemon=True)
+        hashThread.start()
+        try:
+            if len(pending) > 0:
+                with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                    futures = [executor.submit(self.download_segment, i) for i in pending]
+                    try:
+                        for future in as_completed(futures):
+                            future.result()
+                    except BaseException:
+                        # Stop the other segments, what they have so far stays in the manifest.
+                        self.cancelEvent.set()
+                        raise
+                    finally:
+                        self.save_manifest()
+        finally:
+            self.writersDone.set()
+            self.dataWritten.set()
+            hashThread.join()
+
+        if self.cancelEvent.is_set():
+            raise DownloadCancelled()
+        os.remove(self.manifestPath)
+
+    def contiguous_end(self) -> int:
+        # Everything before this offset has been written.
+        with self.lock:
+            for segment in self.segments:
+                if not self.is_segment_done(segment):
+                    return segment[0] + segment[2]
+        return self.size
+
+    def hash_written_data(self):
+        # Segments finish out of order, so this follows the finished prefix of the file and hashes it as it grows,
+        # reading back what was just written (it's still in the page cache). By the time the last segment is done,
+        # only the tail is left to hash. The file is read unbuffered: a buffered reader would read ahead past the
+        # finished prefix and hand back stale bytes the next time around.
+        hasher = hashlib.sha256()
+        position = 0
+        with open(self.location, 'rb', buffering=0) as file:
+            while position < self.size:
+                self.dataWritten.clear()
+                end = self.contiguous_end()
+                if end <= position:
+                    if self.writersDone.is_set():
+                        break
+                    self.dataWritten.wait(0.5)
+                    continue
+                file.seek(position)
+                while position < end:
+                    # Reads can come back short, whatever is missing gets picked up on the next pass.
+                    block = file.read(min(1024 * 1024, end - position))
+                    if not block:
+                        break
+                    hasher.update(block)
+                    position += len(block)
+        if position == self.size:
+            self.sha256 = hasher.hexdigest()
+
+    @staticmethod
+    def is_segment_done(segment) -> bool:
+        return segment[0] + segment[2] > segment[1]
+
+    def load_manifest(self) -> bool:
+        if not os.path.exists(self.manifestPath) or not os.path.exists(self.location):
+            return False
+        try:
+            with open(self.manifestPath, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if manifest.get("url") != self.url or manifest.get("size") != self.size or os.path.getsize(self.location) != self.size:
+            logger.debug("Download manifest doesn't match the file anymore, starting over.")
+            return False
+        self.segments = manifest["segments"]
+        return True
+
+    def save_manifest(self):
+        with self.lock:
+            manifest = {"url": self.url, "size": self.size, "segments": [list(segment) for segment in self.segments]}
+            self.lastManifestSave = time.time()
+        with open(self.manifestPath + ".tmp", 'w') as f:
+            json.dump(manifest, f)
+        os.replace(self.manifestPath + ".tmp", self.manifestPath)
+
+    def report_progress(self):
+        if self.progressCallback is not None:
+            self.progressCallback(self.received, self.size)
+
+    def advance(self, segment, amount):
+        with self.lock:
+            segment[2] += amount
+            self.received += amount
+            saveManifest = time.time() - self.lastManifestSave >= self.manifestSaveInterval
+        self.dataWritten.set()
+        self.report_progress()
+        if saveManifest:
+            self.save_manifest()
+
+    def download_segment(self, index):
+        import requests
+        segment = self.segments[index]
+        attempts = 0
+        while not self.is_segment_done(segment):
+            if self.cancelEvent.is_set():
+                return
+            try:
+                headers = {"Range": f"bytes={segment[0] + segment[2]}-{segment[1]}"}
+                with requests.get(self.url, headers=headers, stream=True, timeout=60) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise requests.exceptions.RequestException(f"Server ignored the range request (status {response.status_code})")
+                    # Unbuffered, so whatever the manifest says was written is actually in the file.
+                    with open(self.location, 'r+b', buffering=0) as file:
+                        file.seek(segment[0] + segment[2])
+                        for data in response.iter_content(downloadChunkSize):
+                            if self.cancelEvent.is_set():
+                                return
+                            data = data[:segment[1] + 1 - (segment[0] + segment[2])]
+                            view = memoryview(data)
+                            while len(view) > 0:
+                                written = file.write(view)
+                                view = view[written:]
+                            self.advance(segment, len(data))
+                            if self.is_segment_done(segment):
+                                break
+                            self.rateLimiter.consume(len(data), self.cancelEvent)
+            except requests.exceptions.RequestException as e:
+                attempts += 1
+                if attempts >= self.maxAttempts:
+                    raise
+                logger.debug(f"Segment {index} of {self.location} failed ({e}), retrying...")
+                time.sleep(attempts)
+
+    def download_single_stream(self):
+        import requests
+        response = requests.get(self.url, stream=True, timeout=60)
+        response.raise_for_status()
+        total_size_in_bytes = response.headers.get('content-length')
+        self.size = int(total_size_in_bytes) if total_size_in_bytes is not None else None
+        self.received = 0
+        self.report_progress()
+        hasher = hashlib.sha256()
+
+        with open(self.location, 'wb') as file:
+            for data in response.iter_content(downloadChunkSize):
+                if self.cancelEvent.is_set():
+                    raise DownloadCancelled()
                 file.write(data)
-                if total_size_in_bytes is not None:  # Only update if 'content-length' was found
-                    current_time = time.time()
-                    if current_time - last_emit_time >= 1:
-                        elapsed_time_since_last_emit = current_time - last_emit_time
-                        download_speed = data_received_since_last_emit / elapsed_time_since_last_emit
-                        logger.debug(f"Download speed: {download_speed / 1024 / 1024:.2f} MBps")
-
-                        # Calculate ETA
-                        remaining_data = total_size_in_bytes - total_data_received
-                        if download_speed != 0:  # Avoid division by zero
-                            eta = int(remaining_data / download_speed)
-                            logger.debug(f"ETA: {eta} seconds")
-                            self.labelTextSignal.emit(eta)
-                        self.updateProgressSignal.emit(int((total_data_received / total_size_in_bytes) * 100))
-                        # Reset tracking variables for the next X seconds
-                        last_emit_time = current_time  # Update last_emit_time
-                        data_received_since_last_emit = 0  # Reset data_received_since_last_emit
-
-            file.flush()
-            file.close()
-
-        except requests.exceptions.RequestException as e:
-            logger.exception(e)
-            if os.path.exists(self.location):
-                os.remove(self.location)
-            raise
-
-        self.doneSignal.emit()
-
-
-class DownloadDialog(QtWidgets.QDialog):
-    def __init__(self, baseLabelText, url, location):
-        super().__init__()
-        self.setWindowTitle(translate_ui_text('Download'))
-        self.previous_percent_completed = -1
-
-        self.download_thread = DownloadThread(url, location)
-
-        self.download_thread.setProgressBarTotalSignal.connect(self.set_progress_bar)
-        self.download_thread.doneSignal.connect(lambda: self.done(0))
-        self.download_thread.labelTextSignal.connect(self.set_eta)
-        self.download_thread.updateProgressSignal.connect(self.update_progress_bar)
-
-        self.layout = QtWidgets.QVBoxLayout()
-        self.baseLabelText = translate_ui_text(baseLabelText)
-        self.label = QtWidgets.QLabel(self.baseLabelText)
-
-        self.layout.addWidget(self.label)
-        self.progress = QtWidgets.QProgressBar(self)
-        self.layout.addWidget(self.progress)
-        self.setLayout(self.layout)
-
-    def set_eta(self, ETASeconds):
-        self.label.setText(f"{self.baseLabelText} ({format_eta(ETASeconds)})")
-
-    def set_progress_bar(self, amount):
-        if amount == -1:
-            self.progress.setRange(0, 0)
-        else:
-            self.progress.setMaximum(100)
-
-    def update_progress_bar(self, percent_completed):
-        if percent_completed != self.previous_percent_completed:
-            self.progress.setValue(percent_completed)
-            self.previous_percent_completed = percent_completed
-
-    def showEvent(self, event):
-        super().showEvent(event)
-        self.download_thread.start()
-
-    def closeEvent(self, event):
-        reply = QtWidgets.QMessageBox.question(
-            self,
-            translate_ui_text('Confirmation'),
-            translate_ui_text('Are you sure you want to quit?'),
-            QtWidgets.QMessageBox.StandardButton.Yes | QtWidgets.QMessageBox.StandardButton.No
-        )
-
-        if reply == QtWidgets.QMessageBox.StandardButton.Yes:
-            self.download_thread.terminate()
-            event.accept()
-            app.exit(0)
-            sys.exit(0)
-        else:
-            event.ignore()
-
-class PackageThread(QtCore.QThread):
-    setLabelTextSignal = QtCore.pyqtSignal(str)
-    setProgressMaxSignal = QtCore.pyqtSignal(int)
-    updateProgressSignal = QtCore.pyqtSignal(int)
-    doneSignal = QtCore.pyqtSignal()
-    showErrorSignal = QtCore.pyqtSignal(str)
-    downloadSignal = QtCore.pyqtSignal(str, str)
-    def __init__(self, packages):
-        super().__init__()
-        self.packages = packages
-        self.downloadDone = threading.Event()
-    def run(self):
-        total_packages = len(self.packages)
-
-        for i, package in enumerate(self.packages):
-            package: str
+                hasher.update(data)
+                self.received += len(data)
+                self.report_progress()
+                self.rateLimiter.consume(len(data), self.cancelEvent)
+        self.sha256 = hasher.hexdigest()
+
+class Wheelhouse:
+    # A local store of downloaded wheels that survives venv rebuilds and rollbacks. Files are indexed by their sha256,
+    # so the same content is only kept once, and are kept under their wheel filename so the folder can be handed
+    # straight to pip with --find-links. Once the folder grows past maxSize, the least recently used wheels go first.
+    # Each entry also remembers the size and mtime it was verified at, so a file that changed since gets re-hashed
+    # before it's trusted again.
+    indexFilename = "index.json"
+
+    def __init__(self, directory, maxSize):
+        self.directory = os.path.abspath(directory)
+        self.maxSize = maxSize
+        self.indexPath = os.path.join(self.directory, self.indexFilename)
+        self.lock = threading.Lock()
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def load_index(self) -> dict:
+        if not os.path.exists(self.indexPath):
+            return {}
+        try:
+            with open(self.indexPath, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Wheelhouse index is unreadable, starting a new one: {e}")
+            return {}
+
+    def save_index(self, index:dict):
+        with open(self.indexPath + ".tmp", 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(self.indexPath + ".tmp", self.indexPath)
+
+    def path_for(self, filename) -> str:
+        return os.path.join(self.directory, filename)
+
+    def is_intact(self, sha256, entry) -> bool:
+        path = self.path_for(entry["filename"])
+        if not os.path.exists(path):
+            return False
+        stat = os.stat(path)
+        if stat.st_size == entry["size"] and stat.st_mtime == entry.get("mtime"):
+            return True
+        # Touched since we last checked it, only trust it if the content is still the same.
+        if stat.st_size != entry["size"] or hash_file(path) != sha256:
+            logger.error(f"{entry['filename']} in the wheelhouse doesn't match its recorded hash, dropping it.")
+            return False
+        entry["mtime"] = stat.st_mtime
+        return True
+
+    def find(self, filename, sha256=None):
+        # Returns the path of the cached wheel, or None if we don't have it (or it got deleted/modified behind our back).
+        # If sha256 is given, only a file with exactly that content counts.
+        with self.lock:
+            index = self.load_index()
+            for entrySha256, entry in list(index.items()):
+                if entry["filename"] != filename:
+                    continue
+                if not self.is_intact(entrySha256, entry):
+                    del index[entrySha256]
+                    self.save_index(index)
+                    return None
+                if sha256 is not None and entrySha256 != sha256:
+                    logger.debug(f"{filename} in the wheelhouse has a different hash than expected, ignoring it.")
+                    return None
+                entry["last_used"] = time.time()
+                self.save_index(index)
+                logger.debug(f"Found {filename} in the wheelhouse.")
+                return self.path_for(filename)
+        return None
+
+    def add(self, path, sha256=None) -> str:
+        # Moves the file into the wheelhouse (if it isn't there already) and records it. Returns its new path.
+        # Pass sha256 if the file was already hashed (e.g. while downloading) to skip reading it again.
+        filename = os.path.basename(path)
+        if sha256 is None:
+            sha256 = hash_file(path)
+        with self.lock:
+            index = self.load_index()
+            existing = index.get(sha256)
+            if existing is not None and os.path.exists(self.path_for(existing["filename"])):
+                if os.path.abspath(path) != self.path_for(existing["filename"]):
+                    os.remove(path)
+                filename = existing["filename"]
+            else:
+                if os.path.abspath(path) != self.path_for(filename):
+                    os.replace(path, self.path_for(filename))
+                # Whatever was recorded under this filename before has just been overwritten.
+                for staleSha256 in [key for key, entry in index.items() if entry["filename"] == filename and key != sha256]:
+                    del index[staleSha256]
+            stat = os.stat(self.path_for(filename))
+            index[sha256] = {"filename": filename, "size": stat.st_size, "mtime": stat.st_mtime, "last_used": time.time()}
+            self.evict(index, keep=sha256)
+            self.save_index(index)
+        return self.path_for(filename)
+
+    def evict(self, index:dict, keep=None):
+        totalSize = sum(entry["size"] for entry in index.values())
+        for sha256, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+            if totalSize <= self.maxSize:
+                break
+            if sha256 == keep:
+                continue
+            logger.debug(f"Evicting {entry['filename']} from the wheelhouse.")
+            path = self.path_for(entry["filename"])
+            if os.path.exists(path):
+                os.remove(path)
+            totalSize -= entry["size"]
+            del index[sha256]
+
+    def find_distribution(self, name, version):
+        # Returns (filename, sha256) of the most recently used file we have for that exact release, or None.
+        from packaging.utils import parse_wheel_filename, parse_sdist_filename, canonicalize_name, InvalidWheelFilename, InvalidSdistFilename
+        from packaging.version import Version, InvalidVersion
+        try:
+            wantedVersion = Version(version)
+        except InvalidVersion:
+            return None
+        with self.lock:
+            index = self.load_index()
+        matches = []
+        for sha256, entry in index.items():
             try:
-
-                completed_process = None
-                if package.startswith("-r"):
-                    # This is all pytorch-specific stuff.
-                    logger.debug(f"Installing {package}")
-                    self.setLabelTextSignal.emit(torchInstallText)
-                    process = subprocess.Popen([sys.executable, '-m', 'pip', 'install', '--no-cache-dir','--upgrade', "-r", package[2:].strip()], stdout=subprocess.PIPE,
-                                               stderr=subprocess.STDOUT,
-                                               creationflags=subprocess_flags)
-                    url = None
-                    isCollecting = False
-                    for line in iter(process.stdout.readline, b''):  # Reads the output line by line.
-                        line = line.decode('utf-8').strip().lower()  # Decodes the bytes to string and removes newline character at the end.
-                        if "collecting torch" in line:
-                            # It's collecting torch
-                            isCollecting = True
-                        if isCollecting and "using cached" in line:
-                            # It's using the cached one. No need to do anything then.
-                            isCollecting = False
-
-                        if isCollecting and "downloading" in line:
-                            url = line[len("downloading"):]
-                            url = url[:url.rindex("(")].strip()
-                            logger.debug("Found correct wheel, killing pip...")
-                            # Pip has selected the wheel to download. Kill it.
-                            process.stdout.close()  # Closes the stdout pipe.
-                            process.terminate()
-                            process.wait()
-                            break
-
-                    if url is not None:
-                        logger.debug(f"URL found: {url}")
-                        import urllib.parse
-                        filename = urllib.parse.unquote(url[url.rindex("/") + 1:])
-                        logger.debug(f"Filename: {filename}")
-
-                        if os.path.exists(filename):
-                            logger.debug("Deleting file...")
-                            os.remove(filename)
-
-                        if self.downloadDone.is_set():
-                            self.downloadDone.clear()
-
-                        self.downloadSignal.emit(url, filename)
-                        self.downloadDone.wait()
-
-                        if not os.path.exists(filename):
-                            self.showErrorSignal.emit(f"An error occurred while installing package '{package}', we were unable to download the corresponding wheel.")
-                            return  # Something went wrong. Throw an error and exit.
-                        # Done downloading it - install it
-                        completed_process = subprocess.run([sys.executable, '-m', 'pip', 'install', filename], check=True, text=True, capture_output=True, creationflags=subprocess_flags)
-                        logger.debug(completed_process.stdout)
-                        # Remove the file
-                        os.remove(filename)
-                        # Now we re-install the requirements from the file.
-                        completed_process = subprocess.run([sys.executable, '-m', 'pip', 'install', '--upgrade', "-r", package[2:].strip()], check=True, text=True, capture_output=True,
-                                                           creationflags=subprocess_flags)
-                    else:
-                        logger.debug("We used the cached torch or it was already installed. This shouldn't happen as I disabled the cache.")
-                    # subprocess.run([sys.executable, '-m', 'pip', 'install', '--upgrade', "-r", package[2:].strip()], check=True, text=True, capture_output=True, creationflags=subprocess_flags)
+                if entry["filename"].endswith(".whl"):
+                    entryName, entryVersion = parse_wheel_filename(entry["filename"])[:2]
                 else:
-                    index = min([package.find(char) for char in ['=', '~', '>'] if package.find(char) != -1], default=-1)
-                    packageName = package if index == -1 else package[:index]
-                    logger.debug(f"Installing {packageName}")
-                    self.setLabelTextSignal.emit(f"{normalInstallText} ({packageName})")
-
-                    completed_process = subprocess.run([sys.executable, '-m', 'pip', 'install', '--upgrade', package], check=True, text=True, capture_output=True, creationflags=subprocess_flags)
-                if completed_process is not None:
-                    logger.debug(completed_process.stdout)
-                logger.debug(f"Current progress: {int((i + 1) / total_packages * 100)}%")
-                self.updateProgressSignal.emit(int((i + 1) / total_packages * 100))
-            except subprocess.CalledProcessError as e:
-                self.showErrorSignal.emit(f"An error occurred while installing package '{package}':\n{e.stderr}")
-                return
-
-        self.doneSignal.emit()
-
-class PackageDownloadDialog(QtWidgets.QDialog):
-    def __init__(self, packages):
-        super().__init__()
-        self.setWindowTitle(translate_ui_text('Download Progress'))
-        self.packages = packages
-
-        self.previous_percent_completed = -1
-
-        self.layout = QtWidgets.QVBoxLayout()
-        self.label = QtWidgets.QLabel(normalInstallText)
-        self.layout.addWidget(self.label)
-
-        self.progress = QtWidgets.QProgressBar(self)
-        self.progress.setMaximum(100)
-
-        self.layout.addWidget(self.progress)
-
-        self.setLayout(self.layout)
-
-        self.packageThread = PackageThread(packages)
-        self.packageThread.doneSignal.connect(lambda: self.done(0))
-        self.packageThread.setLabelTextSignal.connect(self.setText)
-        self.packageThread.updateProgressSignal.connect(self.update_progress_bar)
-        self.packageThread.showErrorSignal.connect(self.showErrorAndExit)
-        self.packageThread.downloadSignal.connect(self.downloadFile)
-
-    def downloadFile(self, url, location):
-        DownloadDialog("Downloading PyTorch", url, location).exec()
-        self.packageThread.downloadDone.set()
-
-    def showErrorAndExit(self, error):
-        logger.error(error)
-        QtWidgets.QMessageBox.critical(self, 'Error', error)
-        sys.exit(1)
-
-    def showEvent(self, event):
-        super().showEvent(event)
-        self.packageThread.start()
-
-    def setText(self, newText:str):
-        if self.label.text() != newText:
-            self.label.setText(newText)
-
-
-    def finish(self):
-        self.done(0)
-
-    def update_progress_bar(self, percent_completed):
-        if percent_completed != self.previous_percent_completed:
-            self.progress.setValue(percent_completed)
-            self.previous_percent_completed = percent_completed
+                    entryName, entryVersion = parse_sdist_filename(entry["filename"])
+            except (InvalidWheelFilename, InvalidSdistFilename):
+                continue
+            if entryName == canonicalize_name(name) and entryVersion == wantedVersion:
+                # Wheels first, then the most recently used.
+                matches.append((entry["filename"].endswith(".whl"), entry["last_used"], entry["filename"], sha256))
+        if len(matches) == 0:
+            return None
+        _isWheel, _lastUsed, filename, sha256 = max(matches)
+        return filename, sha256
+
+    def pip_args(self) -> list:
+        return ['--find-links', self.directory]
+
+wheelhouse = Wheelhouse(repoData.get("wheelhouse_dir", "wheelhouse"), repoData.get("wheelhouse_max_size_mb", 20480) * 1024 * 1024)
+
+class PackageStore:
+    # A machine-wide store of installed package files, shared by every app (and venv rebuild) whose package_store
+    # points at the same folder. Each file is kept once, named by the sha256 its distribution's RECORD lists, and venvs
+    # get hardlinks to it (or copies where that isn't possible, e.g. across drives).
+    # A manifest per wheel, named by the wheel's sha256, lists which file goes where. A release that some venv already
+    # has can then be installed by linking its files instead of unpacking the wheel again.
+    # Every venv registers the manifests it uses. Garbage collection drops the manifests no venv uses anymore, and the
+    # files that are neither in a remaining manifest nor linked into any venv.
+    gcInterval = 60 * 60 * 24
+    gcGracePeriod = 60 * 60 * 24
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(os.path.expandvars(os.path.expanduser(directory)))
+        self.objectsDir = os.path.join(self.directory, "objects")
+        self.manifestsDir = os.path.join(self.directory, "manifests")
+        self.venvsDir = os.path.join(self.directory, "venvs")
+        for folder in [self.objectsDir, self.manifestsDir, self.venvsDir]:
+            os.makedirs(folder, exist_ok=True)
+        venvKey = hashlib.sha256(os.path.normcase(os.path.abspath(sys.prefix)).encode("utf-8")).hexdigest()[:16]
+        self.registryPath = os.path.join(self.venvsDir, venvKey + ".json")
+
+    def object_path(self, sha256) -> str:
+        return os.path.join(self.objectsDir, sha256[:2], sha256)
+
+    def manifest_path(self, wheelSha256) -> str:
+        return os.path.join(self.manifestsDir, wheelSha256 + ".json")
+
+    @staticmethod
+    def write_json(path, data):
+        with open(f"{path}.{os.getpid()}.tmp", 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    @staticmethod
+    def link_or_copy(source, target):
+        # Puts a hardlink to source at target, replacing whatever is there.
+        temporaryPath = f"{target}.{os.getpid()}.tmp"
+        try:
+            try:
+                os.link(source, temporaryPath)
+            except OSError:
+                shutil.copy2(source, temporaryPath)
+            os.replace(temporaryPath, target)
+        except OSError:
+            if os.path.exists(temporaryPath):
+                os.remove(temporaryPath)
+            raise
 
-    def closeEvent(self, event):
-        reply = QtWidgets.QMessageBox.question(
-            self,
-            translate_ui_text('Confirmation'),
-            translate_ui_text('Are you sure you want to quit?'),
-            QtWidgets.QMessageBox.StandardButton.Yes | QtWidgets.QMessageBox.StandardButton.No
-        )
+    def store_file(self, path, sha256):
+        objectPath = self.object_path(sha256)
+        if os.path.exists(objectPath):
+            if not os.path.samefile(objectPath, path):
+                self.link_or_copy(objectPath, path)
+            return
+        os.makedirs(os.path.dirname(objectPath), exist_ok=True)
+        try:
+            os.link(path, objectPath)
+        except FileExistsError:
+            # Another venv stored it in the meantime.
+            self.link_or_copy(objectPath, path)
+        except OSError:
+            self.link_or_copy(path, objectPath)
+
+    def adopt(self, dist, wheelSha256=None):
+        # Moves the files of an installed distribution into the store, leaving links behind. With wheelSha256, also
+        # records the manifest that lets other venvs install it from the store.
+        import base64
+        import sysconfig
+        scriptsDir = os.path.normcase(sysconfig.get_path("scripts"))
+        entryPoints = {entryPoint.name for entryPoint in dist.entry_points if entryPoint.group in ("console_scripts", "gui_scripts")}
+        files = {}
+        complete = True
+        for file in dist.files or []:
+            path = str(file.locate())
+            if "__pycache__" in file.parts or not os.path.isfile(path):
+                continue
+            if os.path.normcase(os.path.dirname(os.path.abspath(path))) == scriptsDir:
+                # Entry point scripts point at this venv's interpreter, they're made again for every venv instead.
+                # Any other kind of script can't be moved to another venv, so neither can the distribution.
+                if re.sub(r"(\.exe|-script\.pyw?)$", "", os.path.basename(path)) not in entryPoints:
+                    complete = False
+                continue
+            if file.hash is not None and file.hash.mode == "sha256" and file.size == os.path.getsize(path):
+                sha256 = base64.urlsafe_b64decode(file.hash.value + "=" * (-len(file.hash.value) % 4)).hex()
+            else:
+                sha256 = hash_file(path)
+            try:
+                self.store_file(path, sha256)
+            except OSError as e:
+                # In use (a DLL of the running app, for example). It's still fine where it is.
+                logger.debug(f"Could not move {path} into the package store: {e}")
+            files[file.as_posix()] = sha256
+
+        if complete and wheelSha256 is not None:
+            self.write_json(self.manifest_path(wheelSha256), {"name": dist.metadata["Name"], "version": dist.version, "files": files})
+            self.register(wheelSha256, dist.metadata["Name"], dist.version)
+
+    def materialize(self, wheelSha256) -> bool:
+        # Installs the release recorded under wheelSha256 into this venv by linking its files out of the store and
+        # making its entry point scripts. Returns False if the store doesn't have all of it.
+        import importlib.metadata
+        import pathlib
+        import sysconfig
+        try:
+            with open(self.manifest_path(wheelSha256), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not all(os.path.exists(self.object_path(sha256)) for sha256 in manifest["files"].values()):
+            return False
+
+        sitePackages = sysconfig.get_path("purelib")
+        written = []
+        try:
+            for relativePath, sha256 in manifest["files"].items():
+                target = os.path.normpath(os.path.join(sitePackages, relativePath))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                self.link_or_copy(self.object_path(sha256), target)
+                written.append(target)
+
+            # The same way pip makes them.
+            from pip._vendor.distlib.scripts import ScriptMaker
+            distInfoDir = next(relativePath.split("/")[0] for relativePath in manifest["files"] if relativePath.split("/")[0].endswith(".dist-info"))
+            maker = ScriptMaker(None, sysconfig.get_path("scripts"))
+            maker.clobber = True
+            maker.variants = {""}
+            maker.set_mode = True
+            for entryPoint in importlib.metadata.PathDistribution(pathlib.Path(sitePackages, distInfoDir)).entry_points:
+                if entryPoint.group in ("console_scripts", "gui_scripts"):
+                    spec = f"{entryPoint.name} = {entryPoint.module}:{entryPoint.attr}" if entryPoint.attr else f"{entryPoint.name} = {entryPoint.value}"
+                    written += maker.make(spec, {"gui": entryPoint.group == "gui_scripts"})
+        except (OSError, ImportError, StopIteration) as e:
+            logger.error(f"Could not install {manifest['name']} {manifest['version']} from the package store: {e}")
+            for path in written:
+                if os.path.exists(path):
+                    os.remove(path)
+            return False
+        self.register(wheelSha256, manifest["name"], manifest["version"])
+        return True
+
+    def load_registry(self) -> dict:
+        try:
+            with open(self.registryPath, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"prefix": sys.prefix, "manifests": {}}
+
+    def register(self, wheelSha256, name, version):
+        registry = self.load_registry()
+        registry["manifests"][wheelSha256] = {"name": name, "version": version}
+        self.write_json(self.registryPath, registry)
+
+    def prune_registry(self):
+        # Forgets the manifests of releases this venv doesn't have installed anymore.
+        import importlib.metadata
+        registry = self.load_registry()
+        for wheelSha256, entry in list(registry["manifests"].items()):
+            try:
+                if importlib.metadata.version(entry["name"]) == entry["version"]:
+                    continue
+            except importlib.metadata.PackageNotFoundError:
+                pass
+            del registry["manifests"][wheelSha256]
+        self.write_json(self.registryPath, registry)
+
+    def collect_garbage(self):
+        stampPath = os.path.join(self.directory, "last-gc")
+        if os.path.exists(stampPath) and time.time() - os.path.getmtime(stampPath) < self.gcInterval:
+            return
+        open(stampPath, 'w').close()
+
+        usedManifests = set()
+        for registryName in os.listdir(self.venvsDir):
+            registryPath = os.path.join(self.venvsDir, registryName)
+            try:
+                with open(registryPath, 'r') as f:
+                    registry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not os.path.isdir(registry.get("prefix", "")):
+                # That venv was deleted.
+                os.remove(registryPath)
+                continue
+            usedManifests.update(registry["manifests"])
+
+        usedObjects = set()
+        for manifestName in os.listdir(self.manifestsDir):
+            manifestPath = os.path.join(self.manifestsDir, manifestName)
+            # Recent manifests are kept too, their venv may just not have registered them yet.
+            if manifestName[:-len(".json")] not in usedManifests and time.time() - os.path.getmtime(manifestPath) > self.gcGracePeriod:
+                os.remove(manifestPath)
+                continue
+            try:
+                with open(manifestPath, 'r') as f:
+                    usedObjects.update(json.load(f)["files"].values())
+            except (OSError, ValueError):
+                continue
+
+        freed = 0
+        for folder, _dirs, names in os.walk(self.objectsDir):
+            for name in names:
+                path = os.path.join(folder, name)
+                stat = os.stat(path)
+                # More than one link means some venv still has it.
+                if name in usedObjects or stat.st_nlink > 1:
+                    continue
+                os.remove(path)
+                freed += stat.st_size
+        logger.debug(f"Package store garbage collection freed {freed / 1024 / 1024:.1f} MB.")
+
+packageStore = PackageStore(repoData["package_store"]) if repoData.get("package_store") else None
+
+def add_to_package_store(distributions:list):
+    # Called after every install with the distributions that changed.
+    if packageStore is None:
+        return
+    with Span("package_store_add", distributions=len(distributions)):
+        for dist in distributions:
+            found = wheelhouse.find_distribution(dist.metadata["Name"], dist.version)
+            packageStore.adopt(dist, found[1] if found is not None and found[0].endswith(".whl") else None)
+        packageStore.prune_registry()
+        packageStore.collect_garbage()
+
+def get_tracked_ref() -> bytes:
+    # The remote ref we follow: a specific branch if repo.json names one, otherwise whatever the remote's HEAD is.
+    branch = repoData.get("branch")
+    return b"HEAD" if not branch else b"refs/heads/" + branch.encode("utf-8")
+
+def reset_working_tree(gitRepo, commitId:bytes):
+    # Hard reset to commitId, also removing files that the new commit doesn't track anymore.
+    oldPaths = set(gitRepo.open_index())
+    gitRepo.refs[b"HEAD"] = commitId
+    gitRepo.reset_index(gitRepo[commitId].tree)
+    for path in oldPaths - set(gitRepo.open_index()):
+        fullPath = os.path.join(gitRepo.path, os.fsdecode(path))
+        if os.path.isfile(fullPath):
+            os.remove(fullPath)
+
+@timed("git_fetch")
+def fetch_update(gitUrl, targetDirectory) -> bytes:
+    # Gets the objects of the tracked ref into the local repository without touching the working tree, and returns
+    # the commit to check out. Only the tip of the tracked branch is fetched by default, so the download scales with
+    # the size of the tree and of each change rather than with the whole history. clone_depth: 0 gets everything.
+    from dulwich import porcelain, client, repo
+    depth = repoData.get("clone_depth", 1) or None
+    if not os.path.exists(targetDirectory):
+        try:
+            porcelain.clone(gitUrl, target=targetDirectory, checkout=False, depth=depth, branch=repoData.get("branch"))
+        except NotImplementedError:
+            # dulwich can't do shallow fetches from local paths, those get a full clone.
+            logger.debug("Shallow clone not supported for this remote, cloning the full history.")
+            shutil.rmtree(targetDirectory, ignore_errors=True)
+            porcelain.clone(gitUrl, target=targetDirectory, checkout=False, branch=repoData.get("branch"))
+        copy_shallow_commits(gitUrl, repo.Repo(targetDirectory))
+        return repo.Repo(targetDirectory).head()
+
+    gitRepo = repo.Repo(targetDirectory)
+    trackedRef = get_tracked_ref()
+    gitClient, path = client.get_transport_and_path(gitUrl, config=gitRepo.get_config_stack())
+
+    def determine_wants(remote_refs, **kwargs):
+        wanted = remote_refs[trackedRef]
+        return [] if wanted in gitRepo.object_store else [wanted]
 
-        if reply == QtWidgets.QMessageBox.StandardButton.Yes:
-            self.packageThread.terminate()
-            event.accept()
-            app.exit(0)
-            sys.exit(0)
-        else:
-            event.ignore()
+    try:
+        fetchResult = gitClient.fetch(path, gitRepo, determine_wants=determine_wants, depth=depth)
+    except NotImplementedError:
+        fetchResult = gitClient.fetch(path, gitRepo, determine_wants=determine_wants)
+    copy_shallow_commits(gitUrl, gitRepo)
+    return fetchResult.refs[trackedRef]
+
+def copy_shallow_commits(gitUrl, gitRepo):
+    # A local source can be a shallow repository itself (an update bundle is), and dulwich doesn't carry that over.
+    # Mark the commits we got without their parents as shallow, or anything walking the history would look for them.
+    if not os.path.isdir(gitUrl):
+        return
+    from dulwich import repo
+    shallow = {commitId for commitId in repo.Repo(gitUrl).get_shallow()
+               if commitId in gitRepo.object_store and any(parent not in gitRepo.object_store for parent in gitRepo[commitId].parents)}
+    if len(shallow - gitRepo.get_shallow()) > 0:
+        gitRepo.update_shallow(shallow, None)
+
+@timed("extract_requirements")
+def extract_requirements(targetDirectory, commitId:bytes, outputDirectory):
+    # Writes the requirement files of a fetched commit to outputDirectory, so the package work can start
+    # while the working tree is still being checked out.
+    # Files they pull in with -r/-c come along too, at the same relative paths, so those references still resolve.
+    import posixpath
+    from dulwich import repo
+    gitRepo = repo.Repo(targetDirectory)
+    tree = gitRepo[gitRepo[commitId].tree]
+    pending = ["requirements.txt", "requirements-torch.txt", get_lock_file_name()]
+    extracted = set()
+    while len(pending) > 0:
+        filename = pending.pop()
+        if filename in extracted:
+            continue
+        extracted.add(filename)
+        outputPath = os.path.join(outputDirectory, *filename.split("/"))
+        try:
+            _mode, blobId = tree.lookup_path(gitRepo.object_store.__getitem__, filename.encode("utf-8"))
+        except KeyError:
+            if os.path.exists(outputPath):
+                os.remove(outputPath)
+            continue
+        os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+        with open(outputPath, 'wb') as f:
+            f.write(gitRepo[blobId].data)
+        if filename.endswith(".json"):
+            continue
+        for reference in get_referenced_requirement_files(outputPath):
+            # pip resolves them relative to the file that references them. Anything outside the repository is left alone.
+            referencePath = posixpath.normpath(posixpath.join(posixpath.dirname(filename), reference.replace("\\", "/")))
+            if not posixpath.isabs(referencePath) and not referencePath.startswith("../"):
+                pending.append(referencePath)
+
+requirementReferencePattern = re.compile(r"^(--requirement|--constraint|-r|-c)\s*=?\s*(\S+)")
+
+def get_referenced_requirement_files(req_file) -> list:
+    # The paths given to -r/--requirement and -c/--constraint in a requirements file.
+    references = []
+    for line in read_requirement_lines(req_file):
+        match = requirementReferencePattern.match(line)
+        if match is not None and "://" not in match.group(2):
+            references.append(match.group(2))
+    return references
+
+@timed("git_checkout")
+def checkout_update(targetDirectory, commitId:bytes):
+    from dulwich import repo
+    reset_working_tree(repo.Repo(targetDirectory), commitId)
 
 def clone_or_pull(gitUrl, targetDirectory):
-    if not os.path.exists(targetDirectory):
-        porcelain.clone(gitUrl, target=targetDirectory)
+    checkout_update(targetDirectory, fetch_update(gitUrl, targetDirectory))
+
+# With staged_updates, the new revision is checked out next to repo_dir and only swapped in once the whole update
+# went through, while the revision it replaced is kept around for --rollback:
+#   <repo_dir>.staging   the revision being prepared
+#   <repo_dir>.previous  the revision that was live before the last swap
+# A swap is two renames. The journal file records which swap was in progress, so a crash in between is finished
+# on the next launch instead of leaving things half-done.
+def get_staging_dir(repoDir) -> str:
+    return os.path.normpath(repoDir) + ".staging"
+
+def get_previous_dir(repoDir) -> str:
+    return os.path.normpath(repoDir) + ".previous"
+
+@timed("prepare_staging")
+def prepare_staging(repoDir) -> str:
+    # Returns the staging directory to fetch into, reusing whatever git objects we already have.
+    stagingDir = get_staging_dir(repoDir)
+    previousDir = get_previous_dir(repoDir)
+    if os.path.exists(stagingDir):
+        # Left over from an interrupted update, just fetch on top of it.
+        return stagingDir
+    if os.path.exists(previousDir):
+        logger.debug(f"Recycling {previousDir} as the staging directory.")
+        os.rename(previousDir, stagingDir)
+    elif os.path.exists(os.path.join(repoDir, ".git")):
+        shutil.copytree(os.path.join(repoDir, ".git"), os.path.join(stagingDir, ".git"))
+    return stagingDir
+
+def carry_untracked_files(sourceDir, targetDir):
+    # Moves whatever the user added to the working tree (settings, downloaded models...) over to the revision that's
+    # about to go live. Files the new revision tracks itself win, __pycache__ is just left behind.
+    from dulwich import repo
+    trackedPaths = {os.fsdecode(path) for path in repo.Repo(sourceDir).open_index()}
+    for root, dirs, files in os.walk(sourceDir):
+        dirs[:] = [name for name in dirs if name not in (".git", "__pycache__")]
+        for name in files:
+            sourcePath = os.path.join(root, name)
+            relativePath = os.path.relpath(sourcePath, sourceDir).replace(os.sep, "/")
+            targetPath = os.path.join(targetDir, relativePath)
+            if relativePath in trackedPaths or os.path.exists(targetPath):
+                continue
+            os.makedirs(os.path.dirname(targetPath), exist_ok=True)
+            os.replace(sourcePath, targetPath)
+
+def swap_in(repoDir, incomingDir, outgoingDir, action):
+    # Makes incomingDir the live repo_dir and moves the current one to outgoingDir. Safe to run again after a crash.
+    with open(stagedUpdateJournal, 'w') as f:
+        json.dump({"action": action, "repo_dir": repoDir}, f)
+    if os.path.exists(repoDir) and os.path.exists(incomingDir):
+        carry_untracked_files(repoDir, incomingDir)
+        if os.path.exists(outgoingDir):
+            shutil.rmtree(outgoingDir)
+        os.rename(repoDir, outgoingDir)
+    if os.path.exists(incomingDir):
+        os.rename(incomingDir, repoDir)
+    os.remove(stagedUpdateJournal)
+
+@timed("activate_staged_update")
+def activate_staged_update(repoDir):
+    logger.debug(f"Activating the staged update in {get_staging_dir(repoDir)}.")
+    swap_in(repoDir, get_staging_dir(repoDir), get_previous_dir(repoDir), "activate")
+    if os.path.exists(rollbackPinFile):
+        os.remove(rollbackPinFile)
+
+def recover_staged_update(repoDir):
+    # Finishes a swap that was interrupted partway through.
+    if not os.path.exists(stagedUpdateJournal):
+        return
+    try:
+        with open(stagedUpdateJournal, 'r') as f:
+            action = json.load(f)["action"]
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Could not read {stagedUpdateJournal}, ignoring it: {e}")
+        os.remove(stagedUpdateJournal)
+        return
+    logger.debug(f"Finishing an interrupted {action} swap.")
+    if action == "rollback":
+        swap_in(repoDir, get_previous_dir(repoDir), get_staging_dir(repoDir), action)
     else:
-        porcelain.pull(targetDirectory, gitUrl)
+        swap_in(repoDir, get_staging_dir(repoDir), get_previous_dir(repoDir), action)
+
+def rollback_update(repoDir, remoteURL) -> bool:
+    # Swaps the previous revision back in. The revision we're leaving is pinned so the update check doesn't bring it
+    # straight back, anything newer than it is installed as usual. Returns False if there's nothing to roll back to.
+    from dulwich import repo
+    if not os.path.exists(get_previous_dir(repoDir)):
+        return False
+    badHead = repo.Repo(repoDir).head().decode("ascii")
+    swap_in(repoDir, get_previous_dir(repoDir), get_staging_dir(repoDir), "rollback")
+    with open(rollbackPinFile, 'w') as f:
+        json.dump({"repo_url": remoteURL, "skipped_head": badHead}, f, indent=2)
+    logger.debug(f"Rolled back from {badHead}, it will be skipped by the update check.")
+    return True
+
+def get_skipped_head(remote_url):
+    if not os.path.exists(rollbackPinFile):
+        return None
+    try:
+        with open(rollbackPinFile, 'r') as f:
+            pin = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read {rollbackPinFile}, ignoring it: {e}")
+        return None
+    return pin.get("skipped_head") if pin.get("repo_url") == remote_url else None
+
+def get_app_output_logger() -> logging.Logger:
+    # The app's own output goes to a separate, size-capped log instead of piling up in memory.
+    appLogger = logging.getLogger(__name__ + ".app")
+    if not appLogger.handlers:
+        appLogger.setLevel(logging.INFO)
+        appLogger.propagate = False
+        handler = logging.handlers.RotatingFileHandler(os.path.join(logsDir, appOutputLogFile), encoding="utf-8",
+                                                       maxBytes=repoData.get("app_log_max_size_mb", 10) * 1024 * 1024,
+                                                       backupCount=repoData.get("app_log_backups", 3))
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+        appLogger.addHandler(handler)
+    return appLogger
 
 def run_startup(repo_dir, script):
     if os.path.exists(os.path.join(repo_dir, script)):
+        logger.debug(f"Launch to app start: {(time.perf_counter() - launchStartTime) * 1000:.0f} ms")
+        record_timing("launch_to_app_start", (time.perf_counter() - launchStartTime) * 1000)
+        appLogger = get_app_output_logger()
+        # Only the tail of the output is kept around for the error report, so memory stays flat however long the app runs.
+        recentOutput = deque(maxlen=repoData.get("app_output_tail_lines", 200))
+        missingModule = False
+
         previousDir = os.getcwd()
         os.chdir(repo_dir)
         try:
-            subprocess.check_output([sys.executable, script], stderr=subprocess.STDOUT, creationflags=subprocess_flags)
-        except subprocess.CalledProcessError as e:
+            process = subprocess.Popen([sys.executable, script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, creationflags=subprocess_flags)
+        finally:
             os.chdir(previousDir)
-
-            error_message = e.output.decode('utf-8')
+        with Span("app_run") as span, process.stdout:
+            for rawLine in process.stdout:
+                line = rawLine.decode('utf-8', errors='replace').rstrip("\r\n")
+                appLogger.info(line)
+                recentOutput.append(line)
+                if "ModuleNotFoundError" in line:
+                    missingModule = True
+            returnCode = process.wait()
+            span.set(exit_code=returnCode, ok=returnCode == 0)
+
+        if returnCode != 0:
+            error_message = "\n".join(recentOutput)
             sys.stderr.write(f"Startup script subprocess stderr:\n {error_message}\n")
-            if "ModuleNotFoundError" in error_message:
+            if missingModule:
                 #Let's signal to the go caller that we need to reinstall some module.
                 open("installing", "w").close()
+                clear_requirements_state()
                 raise ValueError("Missing module.")
             else:
-                raise
-
+                raise subprocess.CalledProcessError(returnCode, process.args, output="\n".join(recentOutput).encode('utf-8'))
+
+
+def read_requirement_lines(req_file):
+    if not os.path.exists(req_file):
+        return []
+    with open(req_file, 'r') as f:
+        lines = f.read().splitlines()
+
+    # Strip out comments and whitespace, ignore empty lines
+    return [line.split('#', 1)[0].strip() for line in lines if line.split('#', 1)[0].strip()]
+
+def get_package_name(requirement:str) -> str:
+    # Grab the distribution name, ignoring extras, version specifiers and markers. Lines that aren't a plain
+    # requirement (urls, pip options) are keyed by the whole line instead.
+    match = re.match(r"^([A-Za-z0-9][A-Za-z0-9._-]*)", requirement)
+    if match is None:
+        return requirement
+    return re.sub(r"[-_.]+", "-", match.group(1)).lower()
+
+def hash_file(path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def get_venv_fingerprint() -> str:
+    # The state is only valid for the venv it was recorded in. If the launcher rebuilds the venv (-delete-venv),
+    # pyvenv.cfg gets recreated and the fingerprint no longer matches, so everything is installed again.
+    pyvenvCfg = os.path.join(sys.prefix, "pyvenv.cfg")
+    createdAt = os.path.getmtime(pyvenvCfg) if os.path.exists(pyvenvCfg) else 0
+    return f"{os.path.abspath(sys.prefix)}|{createdAt}"
+
+def read_requirement_file_tree(req_file) -> tuple:
+    # The requirement lines of req_file with the files it pulls in through -r inlined, and every file involved
+    # (constraint files included). Referenced paths are relative to the file that references them, like pip does it.
+    lines = []
+    files = []
+    pending = [req_file]
+    while len(pending) > 0:
+        path = os.path.normpath(pending.pop(0))
+        if path in files or not os.path.exists(path):
+            continue
+        files.append(path)
+        for line in read_requirement_lines(path):
+            match = requirementReferencePattern.match(line)
+            if match is None or "://" in match.group(2):
+                lines.append(line)
+                continue
+            pending.append(os.path.join(os.path.dirname(path), match.group(2)))
+            if match.group(1) in ("-c", "--constraint"):
+                lines.append(line)
+    return lines, files
+
+def get_requirements_snapshot(repo_dir) -> dict:
+    req_file = os.path.join(repo_dir, 'requirements.txt')
+    torch_req_file = os.path.join(repo_dir, 'requirements-torch.txt')
+    lines, files = read_requirement_file_tree(req_file)
+    if len(files) > 1:
+        # A change in any file requirements.txt pulls in counts as a change to the requirements.
+        requirementsHash = hashlib.sha256("".join(hash_file(path) for path in files).encode("ascii")).hexdigest()
+    else:
+        requirementsHash = hash_file(req_file) if os.path.exists(req_file) else None
+
+    return {
+        "venv": get_venv_fingerprint(),
+        "torch_hash": hash_file(torch_req_file) if os.path.exists(torch_req_file) else None,
+        "requirements_hash": requirementsHash,
+        # Every line, not one per package: the same package can be pinned differently behind different markers.
+        "packages": list(dict.fromkeys(lines))
+    }
 
+def load_requirements_state() -> dict:
+    if not os.path.exists(requirementsStateFile):
+        return {}
+    try:
+        with open(requirementsStateFile, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read {requirementsStateFile}, ignoring it: {e}")
+        return {}
+
+    if state.get("venv") != get_venv_fingerprint():
+        logger.debug("Requirements state was recorded for a different venv, ignoring it.")
+        return {}
+    return state
+
+def save_requirements_state(repo_dir):
+    with open(requirementsStateFile, 'w') as f:
+        json.dump(get_requirements_snapshot(repo_dir), f, indent=2)
+
+def clear_requirements_state():
+    if os.path.exists(requirementsStateFile):
+        os.remove(requirementsStateFile)
+
+@timed("check_requirements")
 def check_requirements(repo_dir):
-    req_file = os.path.join(repo_dir, 'requirements.txt')
+    # Only returns what changed since the last successfully applied requirements, so an update that doesn't
+    # touch them skips the package step entirely.
+    previousState = load_requirements_state()
+    currentState = get_requirements_snapshot(repo_dir)
     packages = []
+
     torch_req_file = os.path.join(repo_dir, 'requirements-torch.txt')
-    if os.path.exists(torch_req_file):
+    if currentState["torch_hash"] is not None and currentState["torch_hash"] != previousState.get("torch_hash"):
         packages.append('-r ' + torch_req_file)
 
-    if os.path.exists(req_file):
-        with open(req_file, 'r') as f:
-            lines = f.read().splitlines()
-
-        # Strip out comments and whitespace, ignore empty lines
-        packages += [line.split('#', 1)[0].strip() for line in lines if line.split('#', 1)[0].strip()]
+    if currentState["requirements_hash"] != previousState.get("requirements_hash"):
+        previousPackages = previousState.get("packages", [])
+        if isinstance(previousPackages, dict):
+            # Written by an older version, keyed by package name.
+            previousPackages = list(previousPackages.values())
+        packages += [line for line in currentState["packages"] if line not in previousPackages]
 
     # Filter out packages that include "pyqt6" in their name. We don't update those.
     packages = [package for package in packages if "pyqt6" not in package.lower()]
+    logger.debug(f"Changed requirements: {packages}")
 
     return packages
 
 
+# Lock snapshots: after a successful update, the exact release (and, when the wheelhouse has it, the file and its
+# sha256) of everything the app's requirements pulled in is written to locks/<commit>.json. Installing that commit
+# again (a rebuilt venv, a rollback) then goes straight to pip install --no-deps --require-hashes from the wheelhouse,
+# with no resolving at all. A lock shipped in the app repo itself (lock_file, same format) takes precedence.
+def get_lock_file_name() -> str:
+    return repoData.get("lock_file", "requirements-lock.json")
+
+def get_head_commit(repoDir) -> str:
+    from dulwich import repo
+    try:
+        return repo.Repo(repoDir).head().decode("ascii")
+    except Exception:
+        return ""
+
+def get_requirement_closure(repo_dir) -> dict:
+    # The installed version of every distribution the requirement files need, directly or through dependencies.
+    import importlib.metadata
+    from packaging.requirements import Requirement, InvalidRequirement
+    from packaging.utils import canonicalize_name
+    pending = []
+    for filename in ["requirements-torch.txt", "requirements.txt"]:
+        for line in read_requirement_lines(os.path.join(repo_dir, filename)):
+            if line.startswith("-"):
+                continue
+            try:
+                requirement = Requirement(line)
+            except InvalidRequirement:
+                continue
+            if requirement.marker is None or requirement.marker.evaluate({"extra": ""}):
+                pending.append(requirement)
+
+    closure = {}
+    visited = set()
+    while len(pending) > 0:
+        requirement = pending.pop()
+        key = (canonicalize_name(requirement.name), frozenset(requirement.extras))
+        if key in visited or "pyqt6" in key[0]:
+            continue
+        visited.add(key)
+        try:
+            distribution = importlib.metadata.distribution(requirement.name)
+        except importlib.metadata.PackageNotFoundError:
+            continue
+        closure[key[0]] = distribution.version
+        for dependency in distribution.requires or []:
+            try:
+                dependency = Requirement(dependency)
+            except InvalidRequirement:
+                # Old metadata can have entries packaging doesn't parse anymore, like "requests (>=2.0.*)".
+                logger.debug(f"Skipping the unparseable dependency {dependency!r} of {requirement.name}")
+                continue
+            if dependency.marker is None or any(dependency.marker.evaluate({"extra": extra}) for extra in {"", *requirement.extras}):
+                pending.append(dependency)
+    return closure
+
+@timed("write_lock")
+def write_lock_snapshot(repo_dir):
+    # The snapshot is only a convenience for later rollbacks, failing to write one shouldn't fail the update.
+    try:
+        save_lock_snapshot(repo_dir)
+    except Exception as e:
+        logger.error(f"Could not write a lock snapshot: {e}")
+
+def save_lock_snapshot(repo_dir):
+    commit = get_head_commit(repo_dir)
+    if commit == "":
+        return
+    packages = []
+    for name, version in sorted(get_requirement_closure(repo_dir).items()):
+        entry = {"name": name, "version": version}
+        # Without a file in the wheelhouse it's still pinned exactly, just installed from the index without a hash.
+        artifact = wheelhouse.find_distribution(name, version)
+        if artifact is not None:
+            entry["filename"], entry["sha256"] = artifact
+        packages.append(entry)
+
+    if not os.path.exists(locksDir):
+        os.makedirs(locksDir)
+    lockPath = os.path.join(locksDir, commit + ".json")
+    with open(lockPath + ".tmp", 'w') as f:
+        json.dump({"commit": commit, "created": time.time(), "packages": packages}, f, indent=2)
+    os.replace(lockPath + ".tmp", lockPath)
+    logger.debug(f"Wrote a lock snapshot of {len(packages)} packages for {commit}.")
+
+    # Only the most recent ones are worth keeping around.
+    snapshots = sorted((os.path.join(locksDir, name) for name in os.listdir(locksDir) if name.endswith(".json")), key=os.path.getmtime)
+    for oldSnapshot in snapshots[:-repoData.get("lock_snapshots_kept", 10)]:
+        os.remove(oldSnapshot)
+
+def load_lock(sourceDir, commit):
+    # The app's own lock (from the requirement files' folder) if it ships one, otherwise our snapshot of that commit.
+    for lockPath in [os.path.join(sourceDir, get_lock_file_name()), os.path.join(locksDir, f"{commit}.json") if commit else None]:
+        if lockPath is None or not os.path.exists(lockPath):
+            continue
+        try:
+            with open(lockPath, 'r') as f:
+                lock = json.load(f)
+            lock["packages"] = [entry for entry in lock["packages"] if "pyqt6" not in entry["name"].lower()]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Could not read the lock {lockPath}, ignoring it: {e}")
+            continue
+        logger.debug(f"Using the lock {lockPath}")
+        return lock
+    return None
+
+def get_lock_changes(lock:dict) -> list:
+    # The lock entries that aren't installed at exactly that version.
+    import importlib.metadata
+    from packaging.version import Version, InvalidVersion
+    changes = []
+    for entry in lock["packages"]:
+        try:
+            installed = importlib.metadata.version(entry["name"])
+            if Version(installed) == Version(entry["version"]):
+                continue
+        except (importlib.metadata.PackageNotFoundError, InvalidVersion):
+            pass
+        changes.append(entry)
+    return changes
+
+# Bytecode for updated files is compiled by a pool of worker processes in the background, instead of serially by pip
+# or on the app's first imports. Run with "python -c" and fed the file list on stdin, so the workers never import
+# (and run) this module.
+precompileScript = """
+import compileall, functools, os, sys
+from concurrent.futures import ProcessPoolExecutor
+if __name__ == "__main__":
+    files = sys.stdin.read().splitlines()
+    workers = min(os.cpu_count() or 1, 61, len(files) // 32 + 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(functools.partial(compileall.compile_file, quiet=2), files, chunksize=32))
+    sys.exit(0 if all(results) else 1)
+"""
+precompileProcesses = []
+
+def get_stale_sources(paths) -> list:
+    # The .py files whose cached bytecode is missing or older than the source.
+    stale = []
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        try:
+            if os.path.getmtime(importlib.util.cache_from_source(path)) >= os.path.getmtime(path):
+                continue
+        except OSError:
+            pass
+        stale.append(path)
+    return stale
+
+def get_repo_sources(repoDir) -> list:
+    sources = []
+    for root, dirs, files in os.walk(repoDir):
+        dirs[:] = [name for name in dirs if name not in (".git", "__pycache__")]
+        sources += [os.path.join(root, name) for name in files if name.endswith(".py")]
+    return sources
+
+def get_distribution_versions() -> dict:
+    import importlib.metadata
+    return {get_package_name(dist.metadata["Name"]): dist.version for dist in importlib.metadata.distributions() if dist.metadata["Name"]}
+
+def get_changed_distributions(distributionsBefore:dict) -> list:
+    # Every distribution that was installed or changed version since distributionsBefore was taken.
+    import importlib.metadata
+    return [dist for dist in importlib.metadata.distributions()
+            if dist.metadata["Name"] and distributionsBefore.get(get_package_name(dist.metadata["Name"])) != dist.version]
+
+def get_package_sources(distributions:list) -> list:
+    return [str(file.locate()) for dist in distributions for file in dist.files or [] if file.suffix == ".py"]
+
+def start_precompile(sources:list):
+    if not repoData.get("precompile", True):
+        return
+    stale = get_stale_sources(sources)
+    if len(stale) == 0:
+        return
+    logger.debug(f"Precompiling {len(stale)} files in the background.")
+    process = subprocess.Popen([sys.executable, '-c', precompileScript], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, text=True, creationflags=subprocess_flags)
+    process.stdin.write("\n".join(stale))
+    process.stdin.close()
+    precompileProcesses.append((process, len(stale)))
+
+def build_bundle_repo(repoDir, commitId:bytes, targetDir):
+    # A bare repository with just the tree of commitId, shallow like a depth 1 clone, that clients fetch from.
+    import stat
+    from dulwich.objects import S_ISGITLINK
+    from dulwich.repo import Repo
+    sourceRepo = Repo(repoDir)
+    objects = [sourceRepo[commitId]]
+    pendingTrees = [objects[0].tree]
+    while len(pendingTrees) > 0:
+        tree = sourceRepo[pendingTrees.pop()]
+        objects.append(tree)
+        for entry in tree.items():
+            if stat.S_ISDIR(entry.mode):
+                pendingTrees.append(entry.sha)
+            elif not S_ISGITLINK(entry.mode):
+                objects.append(sourceRepo[entry.sha])
+
+    bundleRepo = Repo.init_bare(targetDir, mkdir=True)
+    bundleRepo.object_store.add_objects([(obj, None) for obj in objects])
+    branchRef = b"refs/heads/" + (repoData.get("branch") or "main").encode("utf-8")
+    bundleRepo.refs[branchRef] = commitId
+    bundleRepo.refs.set_symbolic_ref(b"HEAD", branchRef)
+    bundleRepo.update_shallow([commitId], None)
+
+def get_bundle_wheel(name, version, downloadDir):
+    # (filename, sha256) of a file for that release in the wheelhouse, downloading it first if we don't have one.
+    found = wheelhouse.find_distribution(name, version)
+    if found is None or wheelhouse.find(*found) is None:
+        get_installer().download(downloadDir, ['--no-deps', *wheelhouse.pip_args(), f"{name}=={version}"])
+        for filename in os.listdir(downloadDir):
+            wheelhouse.add(os.path.join(downloadDir, filename))
+        found = wheelhouse.find_distribution(name, version)
+    return found
+
+@timed("export_bundle")
+def export_bundle(outputPath=None) -> str:
+    # Writes one archive with everything needed to install or update to the current commit without the network:
+    # the repository at that commit, its lock with a file for every package, and the wheels of the base requirements.
+    # Clients point update_source at it. Run it after an update, as the lock is taken from what's installed.
+    import tempfile
+    import zipfile
+    repoDir = repoData["repo_dir"]
+    commit = get_head_commit(repoDir)
+    if not commit:
+        raise ValueError(f"{repoDir} has no commit to export, run an update first.")
+    outputPath = outputPath or f"bundle-{commit[:12]}.zip"
+    save_lock_snapshot(repoDir)
+    lock = load_lock(repoDir, commit)
+
+    workDir = tempfile.mkdtemp(prefix="bundle-")
+    try:
+        packages = []
+        wheels = {}
+        for entry in lock["packages"]:
+            found = get_bundle_wheel(entry["name"], entry["version"], os.path.join(workDir, "downloads", get_package_name(entry["name"])))
+            if found is None:
+                raise ValueError(f"Could not get a file for {entry['name']} {entry['version']}.")
+            packages.append({"name": entry["name"], "version": entry["version"], "filename": found[0], "sha256": found[1]})
+            wheels[found[0]] = found[1]
+        baseWheelsDir = os.path.join(workDir, "base-wheels")
+        get_installer().download(baseWheelsDir, [*wheelhouse.pip_args(), *baserequirements])
+        build_bundle_repo(repoDir, commit.encode("ascii"), os.path.join(workDir, "repo.git"))
+
+        # Wheels are compressed already, storing them as they are keeps writing and reading at disk speed.
+        with zipfile.ZipFile(outputPath + ".tmp", 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for folder in ["repo.git", "base-wheels"]:
+                for root, _dirs, names in os.walk(os.path.join(workDir, folder)):
+                    for name in names:
+                        path = os.path.join(root, name)
+                        archive.write(path, os.path.relpath(path, workDir).replace(os.sep, "/"))
+            for filename in wheels:
+                archive.write(wheelhouse.path_for(filename), "wheels/" + filename)
+            archive.writestr("lock.json", json.dumps({"commit": commit, "packages": packages}, indent=2))
+            archive.writestr(bundleManifestFile, json.dumps({"commit": commit, "created": time.time(), "repo_url": repoData["repo_url"],
+                                                             "wheels": wheels}, indent=2))
+        os.replace(outputPath + ".tmp", outputPath)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+    logger.debug(f"Exported {commit} with {len(wheels)} packages to {outputPath}.")
+    return outputPath
+
+@timed("import_update_source")
+def import_update_source(updateSource):
+    # Brings an update bundle into this install: its lock becomes the lock snapshot of its commit and its wheels go into
+    # the wheelhouse, so the usual update can then run against the repository copy in it (see get_repo_url) and
+    # install everything offline. Only done again once the bundle changes.
+    import zipfile
+    archive = None
+    try:
+        if not os.path.isdir(updateSource):
+            archive = zipfile.ZipFile(updateSource)
+
+        def open_member(name):
+            return archive.open(name) if archive is not None else open(os.path.join(updateSource, *name.split("/")), 'rb')
+
+        with open_member(bundleManifestFile) as f:
+            manifest = json.load(f)
+        statePath = os.path.join(updateSourceDir, updateSourceStateFile)
+        state = {"source": os.path.abspath(updateSource), "commit": manifest["commit"], "created": manifest["created"]}
+        if os.path.exists(statePath):
+            with open(statePath, 'r') as f:
+                if json.load(f) == state:
+                    return
+        logger.debug(f"Importing the update bundle {updateSource} ({manifest['commit']}).")
+
+        os.makedirs(updateSourceDir, exist_ok=True)
+        if archive is not None:
+            shutil.rmtree(os.path.join(updateSourceDir, "repo.git"), ignore_errors=True)
+            for member in archive.namelist():
+                if member.startswith("repo.git/"):
+                    archive.extract(member, updateSourceDir)
+
+        os.makedirs(locksDir, exist_ok=True)
+        lockPath = os.path.join(locksDir, manifest["commit"] + ".json")
+        with open_member("lock.json") as source, open(lockPath + ".tmp", 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(lockPath + ".tmp", lockPath)
+
+        for filename, sha256 in manifest["wheels"].items():
+            if wheelhouse.find(filename, sha256) is not None:
+                continue
+            partialPath = wheelhouse.path_for(filename) + ".part"
+            hasher = hashlib.sha256()
+            with open_member("wheels/" + filename) as source, open(partialPath, 'wb') as target:
+                while True:
+                    chunk = source.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    target.write(chunk)
+            if hasher.hexdigest() != sha256:
+                os.remove(partialPath)
+                raise HashMismatch(f"{filename} in the update bundle does not match its expected sha256 hash.")
+            os.replace(partialPath, wheelhouse.path_for(filename))
+            wheelhouse.add(wheelhouse.path_for(filename), sha256=sha256)
+            current_span().add(wheels=1)
+
+        with open(statePath + ".tmp", 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(statePath + ".tmp", statePath)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile, HashMismatch) as e:
+        logger.error(f"Could not import the update bundle {updateSource}: {e}")
+        current_span().set(ok=False)
+    finally:
+        if archive is not None:
+            archive.close()
+
+def wait_for_precompile():
+    # Called right before the app starts, so its first imports find the bytecode instead of compiling it again.
+    if len(precompileProcesses) == 0:
+        return
+    with Span("precompile_wait", files=sum(fileCount for process, fileCount in precompileProcesses)) as span:
+        while len(precompileProcesses) > 0:
+            process, fileCount = precompileProcesses.pop()
+            if process.wait() != 0:
+                # Usually files that aren't meant to be imported (templates, python 2 leftovers in some packages).
+                span.set(failed_files=True)
+
+@timed("pip_report")
+def get_install_report(pipArgs:list):
+    # Resolves pipArgs with pip install --dry-run and returns everything pip would download, with its url and hash.
+    # Returns None if pip couldn't give us a report (pip older than 22.2, resolver errors...).
+    import urllib.parse
+    completed_process = get_installer().report(pipArgs)
+    if completed_process.returncode != 0:
+        logger.error(f"Could not get an install report from pip: {completed_process.stderr}")
+        return None
+    try:
+        report = json.loads(completed_process.stdout)
+    except ValueError as e:
+        logger.error(f"Could not parse pip's install report: {e}")
+        return None
+
+    artifacts = []
+    for item in report.get("install", []):
+        downloadInfo = item["download_info"]
+        url = downloadInfo["url"]
+        archiveInfo = downloadInfo.get("archive_info", {})
+        sha256 = archiveInfo.get("hashes", {}).get("sha256")
+        if sha256 is None and archiveInfo.get("hash", "").startswith("sha256="):
+            sha256 = archiveInfo["hash"][len("sha256="):]
+        artifacts.append({
+            "name": item["metadata"]["name"],
+            "version": item["metadata"]["version"],
+            "url": url,
+            "filename": urllib.parse.unquote(url.split("#", 1)[0].rsplit("/", 1)[-1]),
+            "sha256": sha256
+        })
+    logger.debug(f"Install report: {artifacts}")
+    return artifacts
+
+def is_requirement_satisfied(requirement) -> bool:
+    import importlib.metadata
+    from packaging.requirements import Requirement, InvalidRequirement
+    try:
+        distribution = importlib.metadata.distribution(requirement.name)
+    except importlib.metadata.PackageNotFoundError:
+        return False
+
+    if not requirement.specifier.contains(distribution.version, prereleases=True):
+        return False
+
+    # Extras pull in their own dependencies, which are only there if someone asked for that extra before.
+    for extra in requirement.extras:
+        for dependency in distribution.requires or []:
+            try:
+                dependency = Requirement(dependency)
+            except InvalidRequirement:
+                # Metadata packaging can't parse (old style like "requests (>=2.0.*)"), so leave the check to pip.
+                return False
+            if dependency.marker is not None and dependency.marker.evaluate({"extra": extra}) \
+                    and not dependency.marker.evaluate({"extra": ""}) and not is_requirement_satisfied(dependency):
+                return False
+    return True
+
+@timed("check_installed")
+def filter_satisfied_requirements(packages):
+    # Checks the installed distributions directly, so requirements that are already met never reach pip.
+    # strict_upgrade in repo.json keeps the old behavior of always running pip install --upgrade.
+    if repoData.get("strict_upgrade", False):
+        return packages
+    from packaging.requirements import Requirement, InvalidRequirement
+
+    unsatisfied = []
+    for package in packages:
+        if package.startswith("-r"):
+            lines = [line for line in read_requirement_lines(package[2:].strip()) if not line.startswith("-")]
+        else:
+            lines = [package]
+
+        try:
+            requirements = [Requirement(line) for line in lines]
+        except InvalidRequirement:
+            # Urls, editable installs and the like - let pip deal with them.
+            unsatisfied.append(package)
+            continue
+
+        if all(requirement.url is None and (
+                (requirement.marker is not None and not requirement.marker.evaluate()) or is_requirement_satisfied(requirement))
+               for requirement in requirements):
+            logger.debug(f"{package} is already satisfied, skipping it.")
+        else:
+            unsatisfied.append(package)
+
+    return unsatisfied
+
+def get_remote_head(remote_url, timeout):
+    # Asks the remote for its HEAD, giving up after timeout seconds. Returns None if it couldn't be reached.
+    from dulwich import client
+    result = {}
+
+    def worker():
+        try:
+            gitClient, path = client.get_transport_and_path(remote_url)
+            remote_refs = gitClient.get_refs(path)
+            result["head"] = remote_refs[get_tracked_ref()].decode("ascii")
+        except Exception as e:
+            logger.error(f"Could not get the refs of {remote_url}: {e}")
+
+    # dulwich has no timeout for this, so wait on it from the outside instead.
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        logger.error(f"Timed out after {timeout}s waiting for {remote_url}.")
+    return result.get("head")
+
+def load_remote_state(remote_url) -> dict:
+    if not os.path.exists(remoteStateFile):
+        return {}
+    try:
+        with open(remoteStateFile, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read {remoteStateFile}, ignoring it: {e}")
+        return {}
+    if state.get("repo_url") != remote_url:
+        return {}
+    return state
+
+def refresh_remote_state(remote_url, timeout):
+    remoteHead = get_remote_head(remote_url, timeout)
+    if remoteHead is not None:
+        with open(remoteStateFile + ".tmp", 'w') as f:
+            json.dump({"repo_url": remote_url, "remote_head": remoteHead, "checked_at": time.time()}, f, indent=2)
+        os.replace(remoteStateFile + ".tmp", remoteStateFile)
+    return remoteHead
+
+@timed("check_if_latest")
 def check_if_latest(repo_path, remote_url) -> bool:
+    # dulwich is the only prerequisite we need on every launch, and it's cheap to import compared to the rest.
+    from dulwich import repo
+
     # Open the local repository
-    gitRepo = dulwich.repo.Repo(repo_path)
+    gitRepo = repo.Repo(repo_path)
 
     # Get the current commit
-    head = gitRepo[b"HEAD"]
+    head = gitRepo.head().decode("ascii")
+
+    # The remote HEAD from the last check is reused until update_check_interval has passed.
+    state = load_remote_state(remote_url)
+    skippedHead = get_skipped_head(remote_url)
+    interval = repoData.get("update_check_interval", 0)
+    timeout = repoData.get("update_check_timeout", 15)
+    if "remote_head" in state and time.time() - state["checked_at"] < interval:
+        current_span().set(cached=True)
+        logger.debug(f"Remote was checked {time.time() - state['checked_at']:.0f}s ago, not checking again.")
+        return head == state["remote_head"] or state["remote_head"] == skippedHead
+
+    if repoData.get("update_check_background", False):
+        # Decide from what we knew as of the last check, and check again while the app runs.
+        # Whatever this check finds gets applied on the next launch. With exec_startup this process is about to be
+        # replaced, so the watchdog does the check instead.
+        if not repoData.get("exec_startup", False):
+            threading.Thread(target=refresh_remote_state, args=(remote_url, timeout)).start()
+        return "remote_head" not in state or head == state["remote_head"] or state["remote_head"] == skippedHead
+
+    remoteHead = refresh_remote_state(remote_url, timeout)
+    if remoteHead is None:
+        # Can't reach the remote - just launch what we have rather than failing.
+        return True
+
+    # Check if current commit is the latest one (or the remote is still on the one we rolled back from)
+    return head == remoteHead or remoteHead == skippedHead
+
+# With background_updates, the app starts right away and a low priority "install.py --background-update" process
+# checks for an update, stages it (see staged updates above) and prefetches its packages into the wheelhouse while the
+# app runs. The staged update is applied on the next launch, or earlier if the app asks for it over the local IPC
+# channel: connect to the port in background-update.json, send "status" or "apply" on one line and read back one
+# line of JSON.
+backgroundUpdateToken = None
+
+def load_background_update_state() -> dict:
+    if not os.path.exists(backgroundUpdateStateFile):
+        return {}
+    try:
+        with open(backgroundUpdateStateFile, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read {backgroundUpdateStateFile}, ignoring it: {e}")
+        return {}
+
+def save_background_update_state(state:dict):
+    # While the daemon listens, the file also holds the token every command has to start with. It's only readable
+    # by the user running the installer, so other local users can't drive the daemon.
+    if "port" in state and backgroundUpdateToken is not None:
+        state = {**state, "token": backgroundUpdateToken}
+    if os.path.exists(backgroundUpdateStateFile + ".tmp"):
+        os.remove(backgroundUpdateStateFile + ".tmp")
+    with os.fdopen(os.open(backgroundUpdateStateFile + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(backgroundUpdateStateFile + ".tmp", backgroundUpdateStateFile)
+
+def send_background_update_command(command, timeout=5):
+    # Returns the daemon's answer, or None if there's no daemon listening.
+    import socket
+    state = load_background_update_state()
+    if state.get("port") is None or state.get("token") is None:
+        return None
+    try:
+        with socket.create_connection(("127.0.0.1", state["port"]), timeout=timeout) as connection:
+            connection.sendall(f"{state['token']} {command}\n".encode("utf-8"))
+            return json.loads(connection.makefile('rb').readline())
+    except (OSError, ValueError):
+        return None
+
+def is_staged_update_ready(repoDir) -> bool:
+    state = load_background_update_state()
+    if state.get("state") != "ready" or not os.path.exists(get_staging_dir(repoDir)):
+        return False
+    # Only on top of the commit it was staged from. If repo_dir moved on since (a foreground update), it's older.
+    if "base" in state and state["base"] != get_head_commit(repoDir):
+        logger.debug(f"The staged update was made for {state['base']}, which isn't checked out anymore. Ignoring it.")
+        return False
+    return True
+
+def discard_background_update(repoDir):
+    # A foreground update brings repo_dir to the latest commit by itself, so whatever the background updater staged
+    # before that is at best the same and at worst older. Applied on the next launch, it would be a downgrade.
+    if not os.path.exists(backgroundUpdateStateFile):
+        return
+    logger.debug("Discarding the background update, a foreground update is running.")
+    send_background_update_command("quit", timeout=1)
+    os.remove(backgroundUpdateStateFile)
+    shutil.rmtree(get_staging_dir(repoDir), ignore_errors=True)
+
+def start_background_update():
+    if send_background_update_command("status", timeout=1) is not None:
+        logger.debug("A background update is already running.")
+        return
+    if os.name == "nt":
+        # Child processes (pip) inherit the priority class.
+        flags = subprocess_flags | get_priority_creationflags(repoData.get("background_update_niceness", 10))
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--background-update", *get_update_source_args()], creationflags=flags,
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--background-update", *get_update_source_args()], start_new_session=True,
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def stop_background_update():
+    # A short-lived app can exit before the daemon is listening, so give it a few seconds to come up.
+    deadline = time.time() + 5
+    while "port" not in load_background_update_state() and time.time() < deadline:
+        time.sleep(0.2)
+    send_background_update_command("quit", timeout=1)
+
+@timed("background_update")
+def stage_background_update(repoURL, repoDir, state:dict):
+    # Does everything an update needs except touching the live repo and venv.
+    state["state"] = "checking"
+    state["base"] = get_head_commit(repoDir)
+    save_background_update_state(state)
+    if check_if_latest(repoDir, repoURL):
+        state["state"] = "up_to_date"
+        return
+
+    state["state"] = "fetching"
+    save_background_update_state(state)
+    stagingDir = prepare_staging(repoDir)
+    commitId = fetch_update(repoURL, stagingDir)
+    checkout_update(stagingDir, commitId)
+
+    packages = filter_satisfied_requirements(check_requirements(stagingDir))
+    if len(packages) > 0:
+        state["state"] = "prefetching"
+        save_background_update_state(state)
+        prefetch_to_wheelhouse(packages, state)
+    state["commit"] = commitId.decode("ascii")
+    state["packages"] = packages
+    state["state"] = "ready"
+
+@timed("prefetch")
+def prefetch_to_wheelhouse(packages:list, state:dict):
+    # Resolves the packages with pip, then downloads what's missing from the wheelhouse with our own (throttled)
+    # downloader. The measured speed is published in the state for "status".
+    requirementArgs = []
+    for package in packages:
+        requirementArgs += ["-r", package[2:].strip()] if package.startswith("-r") else [package]
+    artifacts = get_install_report(['--upgrade', *wheelhouse.pip_args(), *requirementArgs])
+    if artifacts is None:
+        prefetch_with_pip(requirementArgs)
+        return
+
+    speedSamples = {"time": time.monotonic(), "received": 0}
+    def on_progress(received, size):
+        now = time.monotonic()
+        if now - speedSamples["time"] >= 1:
+            state["download_speed"] = int((received - speedSamples["received"]) / (now - speedSamples["time"]))
+            speedSamples["time"] = now
+            speedSamples["received"] = received
+
+    for artifact in artifacts:
+        if wheelhouse.find(artifact["filename"], artifact["sha256"]) is not None:
+            current_span().add(cache_hits=1)
+            continue
+        current_span().add(downloads=1)
+        targetPath = wheelhouse.path_for(artifact["filename"])
+        if artifact["url"].startswith("file:"):
+            import urllib.parse, urllib.request
+            shutil.copyfile(urllib.request.url2pathname(urllib.parse.urlparse(artifact["url"]).path), targetPath)
+            copiedSha256 = hash_file(targetPath)
+            if artifact["sha256"] is not None and copiedSha256 != artifact["sha256"]:
+                os.remove(targetPath)
+                raise HashMismatch(f"{artifact['filename']} does not match its expected sha256 hash.")
+            wheelhouse.add(targetPath, sha256=copiedSha256)
+            continue
+        speedSamples["time"], speedSamples["received"] = time.monotonic(), 0
+        download = ResumableDownload(artifact["url"], targetPath + ".part", on_progress, expectedSha256=artifact["sha256"])
+        download.run()
+        os.replace(targetPath + ".part", targetPath)
+        wheelhouse.add(targetPath, sha256=download.sha256)
+    state.pop("download_speed", None)
+
+def prefetch_with_pip(requirementArgs:list):
+    downloadDir = os.path.join(wheelhouse.directory, "staging", "background-update")
+    try:
+        get_installer().download(downloadDir, [*wheelhouse.pip_args(), *requirementArgs])
+        for filename in os.listdir(downloadDir):
+            wheelhouse.add(os.path.join(downloadDir, filename))
+    finally:
+        shutil.rmtree(downloadDir, ignore_errors=True)
+
+@timed("apply_staged_update")
+def apply_staged_update(repoDir, packages:list):
+    # The headless version of what the update dialog does with a staged update: install its packages from the
+    # wheelhouse, then swap it in.
+    distributionsBefore = get_distribution_versions()
+    if len(packages) > 0:
+        requirementArgs = []
+        for package in packages:
+            requirementArgs += ["-r", package[2:].strip()] if package.startswith("-r") else [package]
+        get_installer().install([*wheelhouse.pip_args(), *requirementArgs], offline=True)
+    activate_staged_update(repoDir)
+    changedDistributions = get_changed_distributions(distributionsBefore)
+    start_precompile(get_package_sources(changedDistributions) + get_repo_sources(repoDir))
+    add_to_package_store(changedDistributions)
+    save_requirements_state(repoDir)
+    write_lock_snapshot(repoDir)
+    wait_for_precompile()
+
+def watch_parent_process():
+    # Returns a function that tells whether the process that started this one is still running.
+    parentPid = os.getppid()
+    if os.name != "nt":
+        return lambda: os.getppid() == parentPid
+    # Windows doesn't reparent orphans, so hold a handle to the parent and ask it instead. The handle keeps the answer
+    # right even if the pid gets reused once the parent is gone.
+    import ctypes
+    kernel32 = ctypes.windll.kernel32
+    SYNCHRONIZE, WAIT_TIMEOUT = 0x00100000, 0x102
+    handle = kernel32.OpenProcess(SYNCHRONIZE, False, parentPid)
+    if not handle:
+        return lambda: False
+    return lambda: kernel32.WaitForSingleObject(handle, 0) == WAIT_TIMEOUT
+
+def run_background_update():
+    global backgroundUpdateToken
+    import secrets
+    import socketserver
+    backgroundUpdateToken = secrets.token_hex(32)
+    repoURL = get_repo_url()
+    repoDir = repoData["repo_dir"]
+    if os.name != "nt":
+        os.nice(repoData.get("background_update_niceness", 10))
+    downloadLimiter.set_rate(repoData.get("background_download_limit_kbps", 2048) * 1024)
+
+    parent_alive = watch_parent_process()
+    state = {"pid": os.getpid(), "state": "starting"}
+    quitEvent = threading.Event()
+    stateLock = threading.Lock()
+
+    class CommandHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            token, _, command = self.rfile.readline().decode("utf-8", errors="replace").strip().partition(" ")
+            if not secrets.compare_digest(token, backgroundUpdateToken):
+                self.wfile.write(json.dumps({"ok": False, "error": "Invalid token."}).encode("utf-8") + b"\n")
+                return
+            with stateLock:
+                if command == "apply" and state["state"] == "ready":
+                    try:
+                        apply_staged_update(repoDir, state["packages"])
+                        state["state"] = "applied"
+                    except (OSError, subprocess.CalledProcessError) as e:
+                        # Whatever got in the way (the app holding files open, pip failing), the next launch retries.
+                        logger.exception(e)
+                        reply = {"ok": False, "error": str(e), **state}
+                    else:
+                        reply = {"ok": True, **state}
+                elif command == "apply":
+                    reply = {"ok": False, "error": "No update is ready to apply.", **state}
+                elif command.startswith("limit "):
+                    # "limit <KB/s>", 0 lifts the limit. For when the app knows the user is waiting (or isn't).
+                    try:
+                        downloadLimiter.set_rate(max(0, int(command.split(" ", 1)[1])) * 1024)
+                        reply = {"ok": True, **state}
+                    except ValueError:
+                        reply = {"ok": False, "error": "Usage: limit <KB/s>", **state}
+                elif command == "quit":
+                    quitEvent.set()
+                    reply = {"ok": True, **state}
+                else:
+                    reply = {"ok": command == "status", **state}
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", repoData.get("background_update_port", 0)), CommandHandler)
+    server.daemon_threads = True
+    state["port"] = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
 
-    # Open the remote repository
-    gitClient, path = client.get_transport_and_path(remote_url)
-    remote_refs = gitClient.get_refs(path)
+    try:
+        stage_background_update(repoURL, repoDir, state)
+    except Exception as e:
+        logger.exception(e)
+        state["state"] = "failed"
+        state["error"] = str(e)
+    with stateLock:
+        save_background_update_state(state)
+    logger.debug(f"Background update finished: {state['state']}")
+
+    # Stay around for "apply" until the process that launched the app says it's done with it (or is gone).
+    while not quitEvent.wait(30):
+        if not parent_alive():
+            break
+    server.shutdown()
+    with stateLock:
+        if state["state"] == "ready":
+            # Applied on the next launch.
+            del state["port"]
+            save_background_update_state(state)
+        elif os.path.exists(backgroundUpdateStateFile):
+            os.remove(backgroundUpdateStateFile)
+    sys.exit(0)
+
+def launch_app(repoDir, startupScript):
+    try:
+        run_startup(repoDir, startupScript)
+        sys.exit(0)
+    except ValueError:
+        exit(99)
+    finally:
+        if repoData.get("background_updates", False):
+            stop_background_update()
+
+def handoff_to_watchdog():
+    # Whatever the installer loaded (Qt, dulwich, requests...) would otherwise stay resident for the whole session
+    # just to watch the app's output, so hand over to a fresh interpreter that only runs the watchdog.
+    for handler in logger.handlers:
+        handler.flush()
+    if os.name == "nt":
+        # There's no real exec on Windows (the launcher would see us exit right away), so ask the launcher to start it.
+        sys.exit(watchdogExitCode)
+    os.execv(sys.executable, [sys.executable, os.path.abspath(__file__), "--watchdog", *get_update_source_args()])
+
+def run_watchdog():
+    # Only the standard library is loaded here. It launches the app, and exits with 99 if a module is missing just
+    # like a normal run would.
+    repoURL = get_repo_url()
+    if repoData.get("update_check_background", False):
+        state = load_remote_state(repoURL)
+        if time.time() - state.get("checked_at", 0) >= repoData.get("update_check_interval", 0):
+            threading.Thread(target=refresh_remote_state, args=(repoURL, repoData.get("update_check_timeout", 15))).start()
+    launch_app(repoData["repo_dir"], repoData["startup_script"])
+
+def load_timing_records() -> list:
+    records = []
+    path = os.path.join(logsDir, timingsFile)
+    for candidate in [path + ".1", path]:
+        if not os.path.exists(candidate):
+            continue
+        with open(candidate, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A line cut short by a crash, skip it.
+                    continue
+    return records
+
+def percentile(sortedValues:list, fraction:float):
+    # Nearest-rank percentile.
+    return sortedValues[max(0, math.ceil(fraction * len(sortedValues)) - 1)]
+
+def print_timing_report(lastRuns=None):
+    records = load_timing_records()
+    if lastRuns is not None:
+        runIds = sorted({record["run"] for record in records})[-lastRuns:]
+        records = [record for record in records if record["run"] in runIds]
+    if len(records) == 0:
+        print(f"No timing records in {os.path.join(logsDir, timingsFile)}.")
+        return
+
+    phases = {}
+    for record in records:
+        phases.setdefault(record["phase"], []).append(record)
+
+    print(f"{len({record['run'] for record in records})} runs, durations in ms")
+    print(f"{'phase':<24}{'count':>7}{'failed':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'MB':>9}{'cache hits':>12}")
+    for phase, phaseRecords in sorted(phases.items(), key=lambda item: -sum(record["duration_ms"] for record in item[1])):
+        durations = sorted(record["duration_ms"] for record in phaseRecords)
+        failed = sum(1 for record in phaseRecords if not record.get("ok", True))
+        megabytes = sum(record.get("bytes") or 0 for record in phaseRecords) / 1024 / 1024
+        cacheHits = sum(record.get("cache_hits", 0) for record in phaseRecords)
+        print(f"{phase:<24}{len(durations):>7}{failed:>8}{percentile(durations, 0.5):>10.0f}{percentile(durations, 0.9):>10.0f}"
+              f"{percentile(durations, 0.99):>10.0f}{durations[-1]:>10.0f}{megabytes:>9.1f}{cacheHits:>12}")
+
+def run_timing_report():
+    # install.py timing-report [--last N]
+    usage = "install.py timing-report [--last N]"
+    lastRuns = get_option_value("--last", usage)
+    if lastRuns is not None:
+        if not lastRuns.isdigit() or int(lastRuns) == 0:
+            sys.stderr.write(f"--last needs a positive number of runs.\nUsage: {usage}\n")
+            sys.exit(2)
+        lastRuns = int(lastRuns)
+    print_timing_report(lastRuns)
+    sys.exit(0)
+
+def run_export_bundle():
+    # install.py export-bundle [--output PATH]
+    outputPath = get_option_value("--output", "install.py export-bundle [--output PATH]")
+    try:
+        outputPath = export_bundle(outputPath)
+    except ValueError as e:
+        sys.stderr.write(f"Could not export the bundle: {e}\n")
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        sys.stderr.write(f"Could not download the packages for the bundle:\n{e.stderr}\n")
+        sys.exit(1)
+    print(f"Wrote {outputPath}")
+    sys.exit(0)
 
-    # Check if current commit is the latest one
-    return head.id == remote_refs[b"HEAD"]
+def run_rollback():
+    repoURL = get_repo_url()
+    repoDir = repoData["repo_dir"]
+    recover_staged_update(repoDir)
+    if not rollback_update(repoDir, repoURL):
+        sys.stderr.write(f"There is no previous version of {repoDir} to roll back to.\n")
+        sys.exit(1)
+    # The code is back, now put its packages back too. Whatever they need is usually still in the wheelhouse.
+    try:
+        import install_ui
+    except ImportError as e:
+        logger.debug(f"{e}: Some other bug happened!")
+        exit(99)
+    install_ui.run_update(repoURL, repoDir, gitUpdate=False, staged=False)
 
-app = QtWidgets.QApplication([])
 def main():
-    if "icon" in repoData:
-        app.setWindowIcon(QtGui.QIcon(repoData["icon"]))
-    app.setStyleSheet(get_stylesheet())
-    repoURL = repoData["repo_url"]
+    if get_update_source():
+        import_update_source(get_update_source())
+    repoURL = get_repo_url()
     repoDir = repoData["repo_dir"]
     startupScript = repoData["startup_script"]
+    recover_staged_update(repoDir)
 
     #If it's missing or not the latest commit anymore, do a pull and make sure the requirements haven't changed.
     #Also if it was previously installing and was interrupted partway through.
-    if os.path.exists("installing") or not os.path.exists(repoDir) or not check_if_latest(repoDir, repoURL):
-        open("installing", 'w').close()
-        messageBox = QtWidgets.QMessageBox()
-        messageBox.setWindowTitle(translate_ui_text("Update"))
-        messageBox.setText(translate_ui_text("Updating Github repository..."))
-        messageBox.setStandardButtons(QtWidgets.QMessageBox.StandardButton.NoButton)
-        signalEmitter = SignalEmitter()
-        signalEmitter.signal.connect(lambda: messageBox.done(0))
-        def thread_func():
-            clone_or_pull(repoURL, repoDir)
-            signalEmitter.signal.emit()
-        pullThread = threading.Thread(target=thread_func)
-        pullThread.start()
-        QtCore.QTimer.singleShot(1, lambda: (messageBox.activateWindow(), messageBox.raise_()))
-        messageBox.show()
-        app.exec()
-        packages = check_requirements(repoDir)
-
-        if len(packages) > 0:
-            dialog = PackageDownloadDialog(packages)
-            dialog.show()
-            app.exec()
-        os.remove("installing")
-    try:
-        run_startup(repoDir, startupScript)
-        app.exit(0)
-        sys.exit(0)
-    except ValueError:
-        exit(99)
+    needsInstall = os.path.exists("installing") or not os.path.exists(repoDir)
+    if repoData.get("background_updates", False) and not needsInstall:
+        if is_staged_update_ready(repoDir):
+            try:
+                import install_ui
+            except ImportError as e:
+                logger.debug(f"{e}: Some other bug happened!")
+                exit(99)
+            install_ui.run_update(repoURL, repoDir, gitUpdate=False, staged=True)
+            os.remove(backgroundUpdateStateFile)
+        start_background_update()
+    elif needsInstall or not check_if_latest(repoDir, repoURL):
+        # Only now is it worth loading Qt and the rest of the UI.
+        try:
+            import install_ui
+        except ImportError as e:
+            logger.debug(f"{e}: Some other bug happened!")
+            exit(99)
+        discard_background_update(repoDir)
+        install_ui.run_update(repoURL, repoDir)
+    wait_for_precompile()
+    if repoData.get("exec_startup", False):
+        handoff_to_watchdog()
+    launch_app(repoDir, startupScript)
 
 
 if __name__ == "__main__":
@@ -623,4 +2461,14 @@ if __name__ == "__main__":
         import ctypes
         myappid = u'lugia19.installer'
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+    if sys.argv[1:2] == ["timing-report"]:
+        run_timing_report()
+    if sys.argv[1:2] == ["export-bundle"]:
+        run_export_bundle()
+    if "--watchdog" in sys.argv[1:]:
+        run_watchdog()
+    if "--background-update" in sys.argv[1:]:
+        run_background_update()
+    if "--rollback" in sys.argv[1:]:
+        run_rollback()
     main()
@@ -0,0 +1,738 @@
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from PyQt6 import QtWidgets, QtCore, QtGui
+
+from install import logger, repoData, get_installer, wheelhouse, Span, current_span, format_eta, get_package_name, hash_file, get_install_report, \
+    translate_ui_text, translationListeners, start_background_translation, normalInstallText, torchInstallText, \
+    installingText, downloadingText, ResumableDownload, DownloadCancelled, HashMismatch, downloadManifestSuffix, fetch_update, extract_requirements, \
+    checkout_update, get_head_commit, load_lock, get_lock_changes, write_lock_snapshot, get_staging_dir, prepare_staging, activate_staged_update, \
+    get_repo_sources, get_distribution_versions, get_changed_distributions, get_package_sources, start_precompile, \
+    packageStore, add_to_package_store, check_requirements, \
+    filter_satisfied_requirements, save_requirements_state
+
+colors_dict = {
+    "primary_color":"#1A1D22",
+    "secondary_color":"#282C34",
+    "hover_color":"#596273",
+    "text_color":"#FFFFFF",
+    "toggle_color":"#4a708b",
+    "green":"#3a7a3a",
+    "yellow":"#7a7a3a",
+    "red":"#7a3a3a"
+}
+
+class TranslationUpdater(QtCore.QObject):
+    # Keeps track of which widget shows which string, and swaps in the translations once they arrive.
+    translationsReadySignal = QtCore.pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.bindings = []
+        self.translationsReadySignal.connect(self.apply_translations)
+        # The listener gets called from the translation thread, the signal moves it back to the UI thread.
+        translationListeners.append(self.translationsReadySignal.emit)
+
+    def bind(self, setter, text):
+        setter(translate_ui_text(text))
+        self.bindings.append((setter, text))
+
+    def apply_translations(self):
+        for setter, text in list(self.bindings):
+            try:
+                setter(translate_ui_text(text))
+            except RuntimeError:
+                # The widget is gone already.
+                self.bindings.remove((setter, text))
+
+def get_stylesheet():
+    styleSheet = """
+    * {
+        background-color: {primary_color};
+        color: {secondary_color};
+    }
+    
+    QLabel {
+        color: {text_color};
+    }
+    
+    QMessageBox {
+        background-color: {primary_color};
+        color: {text_color};
+    }
+    
+    QProgressBar {
+            border: 0px solid {hover_color};
+            text-align: center;
+            background-color: {secondary_color};
+            color: {text_color};
+    }
+    QProgressBar::chunk {
+        background-color: {toggle_color};
+    }
+    
+    QPushButton {
+        background-color: {secondary_color};
+        color: {text_color};
+    }
+    
+    QPushButton:hover {
+        background-color: {hover_color};
+    }
+    """
+
+    for colorKey, colorValue in colors_dict.items():
+        styleSheet = styleSheet.replace("{" + colorKey + "}", colorValue)
+    return styleSheet
+
+class DownloadThread(QtCore.QThread):
+    setProgressBarTotalSignal = QtCore.pyqtSignal(int)
+    updateProgressSignal = QtCore.pyqtSignal(int)
+    labelTextSignal = QtCore.pyqtSignal(int, float)  # ETA in seconds, measured speed in bytes per second
+    doneSignal = QtCore.pyqtSignal()
+    failedSignal = QtCore.pyqtSignal(str)
+
+    def __init__(self, url, location, sha256=None):
+        super().__init__()
+        self.url = url
+        self.location = location
+        self.expectedSha256 = sha256
+        self.sha256 = None
+        self.cancelEvent = threading.Event()
+        self.progressLock = threading.Lock()
+
+    def cancel(self):
+        self.cancelEvent.set()
+
+    def run(self):
+        self.total_size_in_bytes = None
+        self.last_emit_time = None
+        self.data_received_at_last_emit = 0
+
+        try:
+            download = ResumableDownload(self.url, self.location, self.on_progress, cancelEvent=self.cancelEvent, expectedSha256=self.expectedSha256)
+            download.run()
+            self.sha256 = download.sha256
+        except DownloadCancelled:
+            logger.debug(f"Download of {self.location} cancelled, keeping the partial file to resume later.")
+            return
+        except (requests.exceptions.RequestException, OSError) as e:
+            logger.exception(e)
+            # Only throw away the partial file if it can't be resumed.
+            if os.path.exists(self.location) and not os.path.exists(self.location + downloadManifestSuffix):
+                os.remove(self.location)
+            self.failedSignal.emit(str(e))
+            return
+        except HashMismatch as e:
+            logger.error(e)
+            if os.path.exists(self.location):
+                os.remove(self.location)
+            self.failedSignal.emit(str(e))
+            return
+        except Exception as e:
+            # Whatever it was, the package thread is waiting on this download and has to hear about it.
+            logger.exception(e)
+            self.failedSignal.emit(str(e))
+            return
+
+        self.doneSignal.emit()
+
+    def on_progress(self, total_data_received, total_size_in_bytes):
+        with self.progressLock:
+            current_time = time.time()
+            if self.last_emit_time is None:
+                # First report, set up the bar.
+                if total_size_in_bytes is None:  # If 'content-length' is not found in headers
+                    self.setProgressBarTotalSignal.emit(-1)  # Set progress bar to indeterminate state
+                else:
+                    self.setProgressBarTotalSignal.emit(total_size_in_bytes)
+                self.total_size_in_bytes = total_size_in_bytes
+                self.last_emit_time = current_time
+                self.data_received_at_last_emit = total_data_received
+                return
+
+            if self.total_size_in_bytes is not None and current_time - self.last_emit_time >= 1:  # Only update if 'content-length' was found
+                elapsed_time_since_last_emit = current_time - self.last_emit_time
+                download_speed = (total_data_received - self.data_received_at_last_emit) / elapsed_time_since_last_emit
+                logger.debug(f"Download speed: {download_speed / 1024 / 1024:.2f} MBps")
+
+                # Calculate ETA
+                remaining_data = self.total_size_in_bytes - total_data_received
+                if download_speed != 0:  # Avoid division by zero
+                    eta = int(remaining_data / download_speed)
+                    logger.debug(f"ETA: {eta} seconds")
+                    self.labelTextSignal.emit(eta, download_speed)
+                self.updateProgressSignal.emit(int((total_data_received / self.total_size_in_bytes) * 100))
+                # Reset tracking variables for the next X seconds
+                self.last_emit_time = current_time
+                self.data_received_at_last_emit = total_data_received
+
+
+class PackageThread(QtCore.QThread):
+    setLabelTextSignal = QtCore.pyqtSignal(str)
+    setProgressMaxSignal = QtCore.pyqtSignal(int)
+    updateProgressSignal = QtCore.pyqtSignal(int)
+    doneSignal = QtCore.pyqtSignal()
+    showErrorSignal = QtCore.pyqtSignal(str)
+    downloadSignal = QtCore.pyqtSignal(str, str, str)
+    def __init__(self, packages, lockEntries=None):
+        super().__init__()
+        self.packages = packages
+        self.lockEntries = lockEntries
+        self.downloadDone = threading.Event()
+        self.downloadSucceeded = False
+        self.downloadedSha256 = None
+        self.downloadError = None
+    def run(self):
+        distributionsBefore = get_distribution_versions()
+        if self.install_all():
+            changedDistributions = get_changed_distributions(distributionsBefore)
+            start_precompile(get_package_sources(changedDistributions))
+            add_to_package_store(changedDistributions)
+            self.doneSignal.emit()
+
+    def install_all(self) -> bool:
+        self.total_packages = len(self.packages)
+        self.completed_packages = 0
+        batchedPackages = []
+
+        if self.lockEntries is not None:
+            try:
+                with Span("lock_install", packages=len(self.lockEntries)) as span:
+                    installed = self.install_from_lock(self.lockEntries)
+                    span.set(ok=installed)
+                if installed:
+                    return True
+            except subprocess.CalledProcessError as e:
+                logger.error(f"Installing from the lock failed, resolving the requirements instead: {e.stderr or e.output}")
+            except Exception as e:
+                logger.exception(e)
+                logger.error(f"Installing from the lock failed, resolving the requirements instead: {e}")
+
+        for package in self.packages:
+            package: str
+            try:
+                if package.startswith("-r"):
+                    with Span("torch_requirements", requirements=package[2:].strip()) as span:
+                        succeeded = self.install_torch_requirements(package)
+                        span.set(ok=succeeded)
+                    if not succeeded:
+                        return False
+                elif repoData.get("batch_install", True):
+                    # Plain requirements are all resolved together once the requirement files are done.
+                    batchedPackages.append(package)
+                    continue
+                else:
+                    with Span("pip_install", package=get_package_name(package)):
+                        self.install_package(package)
+                self.report_progress(self.completed_packages + 1)
+            except subprocess.CalledProcessError as e:
+                self.showErrorSignal.emit(f"An error occurred while installing package '{package}':\n{e.stderr or e.output}")
+                return False
+            except Exception as e:
+                logger.exception(e)
+                self.showErrorSignal.emit(f"An error occurred while installing package '{package}':\n{e}")
+                return False
+
+        if len(batchedPackages) > 0:
+            try:
+                with Span("pip_prefetch_install", packages=len(batchedPackages)):
+                    self.prefetch_and_install(batchedPackages)
+            except subprocess.CalledProcessError as e:
+                self.showErrorSignal.emit(f"An error occurred while installing packages {', '.join(batchedPackages)}:\n{e.stderr or e.output}")
+                return False
+            except Exception as e:
+                logger.exception(e)
+                self.showErrorSignal.emit(f"An error occurred while installing packages {', '.join(batchedPackages)}:\n{e}")
+                return False
+
+        return True
+
+    def report_progress(self, completed_packages:float):
+        self.completed_packages = completed_packages
+        percent = int(completed_packages / self.total_packages * 100)
+        logger.debug(f"Current progress: {percent}%")
+        self.updateProgressSignal.emit(percent)
+
+    def install_torch_requirements(self, package:str) -> bool:
+        # This is all pytorch-specific stuff, though it works for any requirement file with big wheels in it.
+        # pip resolves the whole file once and tells us exactly what it would download, we fetch all of it with our
+        # own downloader into the wheelhouse, and then pip installs the lot without touching the network.
+        logger.debug(f"Installing {package}")
+        self.setLabelTextSignal.emit(translate_ui_text(torchInstallText))
+        reqFile = package[2:].strip()
+        startingProgress = self.completed_packages
+
+        artifacts = get_install_report(['--upgrade', *wheelhouse.pip_args(), "-r", reqFile])
+        if artifacts is None:
+            # Old pip without --report or some other resolver trouble - let pip do all of it itself.
+            completed_process = get_installer().install([*wheelhouse.pip_args(), "-r", reqFile])
+            logger.debug(completed_process.stdout)
+            return True
+
+        for i, artifact in enumerate(artifacts):
+            # The report carries the index's sha256 when it has one, then only a file with that exact content is reused.
+            if wheelhouse.find(artifact["filename"], artifact["sha256"]) is not None:
+                current_span().add(cache_hits=1)
+                continue
+            current_span().add(downloads=1)
+            error = self.fetch_artifact(artifact["url"], artifact["filename"], artifact["sha256"])
+            if error is not None:
+                self.showErrorSignal.emit(f"An error occurred while installing package '{package}', {error}.")
+                return False  # Something went wrong. Throw an error and exit.
+            self.report_progress(startingProgress + (i + 1) / len(artifacts) * 0.9)
+
+        # Everything is in the wheelhouse now. The wheels stay there for the next venv rebuild.
+        try:
+            completed_process = get_installer().install([*wheelhouse.pip_args(), "-r", reqFile], offline=True)
+        except subprocess.CalledProcessError as e:
+            logger.debug(f"Offline install failed, retrying with the index: {e.stderr}")
+            completed_process = get_installer().install([*wheelhouse.pip_args(), "-r", reqFile])
+        logger.debug(completed_process.stdout)
+        return True
+
+    def fetch_artifact(self, url, filename, sha256):
+        # Gets one file into the wheelhouse, through the download dialog row. Returns why it failed, or None.
+        if url.startswith("file:"):
+            # Already on disk (a local index or find-links folder), just take a copy.
+            localPath = urllib.request.url2pathname(urllib.parse.urlparse(url).path)
+            try:
+                # The wheelhouse can be one of pip's find-links folders, then the file is already where it has to be.
+                if not (os.path.exists(wheelhouse.path_for(filename)) and os.path.samefile(localPath, wheelhouse.path_for(filename))):
+                    shutil.copyfile(localPath, wheelhouse.path_for(filename))
+                copiedSha256 = hash_file(wheelhouse.path_for(filename))
+            except OSError as e:
+                logger.exception(e)
+                return f"we were unable to copy {filename} ({e})"
+            if sha256 is not None and copiedSha256 != sha256:
+                os.remove(wheelhouse.path_for(filename))
+                return f"{filename} does not match its expected hash"
+            wheelhouse.add(wheelhouse.path_for(filename), sha256=copiedSha256)
+            return None
+
+        logger.debug(f"Downloading {url}")
+        # Download next to the wheelhouse under a temporary name, so pip never sees a partial wheel.
+        partialPath = wheelhouse.path_for(filename) + ".part"
+
+        if self.downloadDone.is_set():
+            self.downloadDone.clear()
+
+        self.downloadSignal.emit(url, partialPath, sha256 or "")
+        self.downloadDone.wait()
+
+        if not self.downloadSucceeded or not os.path.exists(partialPath):
+            return f"we were unable to download {filename} ({self.downloadError or 'the download did not finish'})"
+        try:
+            os.replace(partialPath, wheelhouse.path_for(filename))
+        except OSError as e:
+            logger.exception(e)
+            return f"we were unable to move {filename} into the wheelhouse ({e})"
+        wheelhouse.add(wheelhouse.path_for(filename), sha256=self.downloadedSha256)
+        return None
+
+    def install_from_lock(self, entries:list) -> bool:
+        # Installs the exact releases of the lock without resolving anything. Entries with a hash are checked against
+        # it and come from the wheelhouse (or the lock's url, or the index). Returns False if the lock can't be used.
+        logger.debug(f"Installing {len(entries)} packages from the lock")
+        self.setLabelTextSignal.emit(translate_ui_text(normalInstallText))
+        if packageStore is not None:
+            entries = self.install_from_store(entries)
+        hashed = [entry for entry in entries if entry.get("filename") and entry.get("sha256")]
+        unhashed = [entry for entry in entries if entry not in hashed]
+
+        allLocal = True
+        for entry in hashed:
+            if wheelhouse.find(entry["filename"], entry["sha256"]) is not None:
+                current_span().add(cache_hits=1)
+            elif entry.get("url"):
+                error = self.fetch_artifact(entry["url"], entry["filename"], entry["sha256"])
+                if error is not None:
+                    logger.error(f"Could not fetch {entry['filename']} from the lock: {error}")
+                    return False
+            else:
+                allLocal = False
+        self.updateProgressSignal.emit(30)
+
+        if len(hashed) > 0:
+            reqFile = tempfile.NamedTemporaryFile('w', suffix='.txt', prefix='requirements-lock-', delete=False)
+            try:
+                with reqFile:
+                    reqFile.write("".join(f"{entry['name']}=={entry['version']} --hash=sha256:{entry['sha256']}\n" for entry in hashed))
+                completed_process = get_installer().install([*wheelhouse.pip_args(), "-r", reqFile.name], upgrade=False, offline=allLocal,
+                                                            noDeps=True, requireHashes=True)
+                logger.debug(completed_process.stdout)
+            finally:
+                os.remove(reqFile.name)
+        self.updateProgressSignal.emit(80)
+
+        if len(unhashed) > 0:
+            completed_process = get_installer().install([*wheelhouse.pip_args(), *[f"{entry['name']}=={entry['version']}" for entry in unhashed]],
+                                                        upgrade=False, noDeps=True)
+            logger.debug(completed_process.stdout)
+        self.updateProgressSignal.emit(100)
+        return True
+
+    def install_from_store(self, entries:list) -> list:
+        # Links the lock entries the package store already has into the venv. Only for packages that aren't installed
+        # at all, others need to be uninstalled first, so that's left to the installer. Returns the entries left.
+        import importlib.metadata
+        remaining = []
+        with Span("package_store_install") as span:
+            for entry in entries:
+                try:
+                    importlib.metadata.version(entry["name"])
+                    remaining.append(entry)
+                    continue
+                except importlib.metadata.PackageNotFoundError:
+                    pass
+                if entry.get("sha256") and packageStore.materialize(entry["sha256"]):
+                    logger.debug(f"Installed {entry['name']} {entry['version']} from the package store.")
+                    span.add(store_hits=1)
+                else:
+                    remaining.append(entry)
+        return remaining
+
+    def install_package(self, package:str):
+        packageName = get_package_name(package)
+        logger.debug(f"Installing {packageName}")
+        self.setLabelTextSignal.emit(f"{translate_ui_text(normalInstallText)} ({packageName})")
+
+        completed_process = get_installer().install([*wheelhouse.pip_args(), package])
+        logger.debug(completed_process.stdout)
+
+    def prefetch_and_install(self, packages:list):
+        # Downloads everything in parallel first, then installs offline from what was downloaded.
+        # If the offline install is missing something (build dependencies of an sdist, for example), it goes online.
+        stagingDirs = self.prefetch_packages(packages, len(packages) * 0.5)
+        if stagingDirs is None:
+            self.install_batched(packages, self.total_packages - self.completed_packages)
+            return
+
+        try:
+            self.install_batched(packages, self.total_packages - self.completed_packages, offlineDirs=stagingDirs)
+        except subprocess.CalledProcessError as e:
+            logger.debug(f"Offline install failed, retrying with the index: {e.output}")
+            self.install_batched(packages, self.total_packages - self.completed_packages)
+        finally:
+            self.keep_downloads(stagingDirs)
+
+    def keep_downloads(self, stagingDirs:list):
+        # Moves what was downloaded into the wheelhouse for next time, and removes the staging folders.
+        for stagingDir in stagingDirs:
+            if os.path.isdir(stagingDir):
+                for filename in os.listdir(stagingDir):
+                    wheelhouse.add(os.path.join(stagingDir, filename))
+            shutil.rmtree(stagingDir, ignore_errors=True)
+
+    def prefetch_packages(self, packages:list, progressShare:float):
+        # Runs one pip download per requirement in a thread pool. Each gets its own staging folder, as two
+        # downloads of a shared dependency must not write the same file at the same time.
+        # Returns the staging folders, or None if prefetching is disabled or something couldn't be downloaded.
+        workers = repoData.get("prefetch_workers", 4)
+        if workers <= 0:
+            return None
+
+        logger.debug(f"Prefetching {len(packages)} packages with {workers} workers")
+        stagingRoot = os.path.join(wheelhouse.directory, "staging")
+        startingProgress = self.completed_packages
+        stagingDirs = []
+        failed = False
+
+        def staging_dir_for(package):
+            return os.path.join(stagingRoot, re.sub(r"[^A-Za-z0-9._-]", "_", get_package_name(package)))
+
+        def download(package):
+            stagingDir = staging_dir_for(package)
+            with Span("pip_download", package=get_package_name(package)):
+                completed_process = get_installer().download(stagingDir, [*wheelhouse.pip_args(), package])
+            logger.debug(completed_process.stdout)
+            return stagingDir
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(download, package): package for package in packages}
+            for downloaded, future in enumerate(as_completed(futures), start=1):
+                packageName = get_package_name(futures[future])
+                try:
+                    stagingDirs.append(future.result())
+                except subprocess.CalledProcessError as e:
+                    logger.error(f"Could not prefetch {packageName}: {e.stderr}")
+                    # Whatever it got before failing isn't indexed anywhere, don't leave it lying around.
+                    shutil.rmtree(staging_dir_for(futures[future]), ignore_errors=True)
+                    failed = True
+                self.setLabelTextSignal.emit(f"{translate_ui_text(normalInstallText)} ({packageName})")
+                self.report_progress(startingProgress + downloaded / len(packages) * progressShare)
+
+        if failed:
+            # The installer fetches everything itself now, but what did download is still worth keeping.
+            self.keep_downloads(stagingDirs)
+            return None
+        return stagingDirs
+
+    def install_batched(self, packages:list, progressShare:float, offlineDirs=None):
+        # One installer run for everything, so there's a single resolver pass (and a single interpreter startup).
+        # Progress comes from the installer's own output, as it collects each of the requested packages.
+        logger.debug(f"Installing {len(packages)} packages in one batch")
+        self.setLabelTextSignal.emit(translate_ui_text(normalInstallText))
+        requestedNames = {get_package_name(package) for package in packages}
+        collectedNames = set()
+        startingProgress = self.completed_packages
+
+        sourceArgs = wheelhouse.pip_args()
+        for offlineDir in offlineDirs or []:
+            sourceArgs += ['--find-links', offlineDir]
+
+        def on_progress(event, packageName):
+            if event == "collecting" and packageName in requestedNames and packageName not in collectedNames:
+                collectedNames.add(packageName)
+                self.setLabelTextSignal.emit(f"{translate_ui_text(normalInstallText)} ({packageName})")
+                # Keep the last bit of the bar for the actual install step.
+                self.report_progress(startingProgress + len(collectedNames) / len(requestedNames) * progressShare * 0.9)
+            elif event == "installing":
+                self.setLabelTextSignal.emit(translate_ui_text(installingText))
+
+        reqFile = tempfile.NamedTemporaryFile('w', suffix='.txt', prefix='requirements-batch-', delete=False)
+        try:
+            with reqFile:
+                reqFile.write("\n".join(packages) + "\n")
+
+            with Span("pip_install_batch", packages=len(packages), offline=offlineDirs is not None, installer=get_installer().name):
+                output = get_installer().install_with_progress([*sourceArgs, "-r", reqFile.name], on_progress, offline=offlineDirs is not None)
+        finally:
+            os.remove(reqFile.name)
+
+        logger.debug(output)
+        self.report_progress(startingProgress + progressShare)
+
+class GitUpdateThread(QtCore.QThread):
+    requirementsReadySignal = QtCore.pyqtSignal(str, str)
+    doneSignal = QtCore.pyqtSignal()
+    showErrorSignal = QtCore.pyqtSignal(str)
+
+    def __init__(self, repoURL, repoDir, requirementsDir, staged=False):
+        super().__init__()
+        self.repoURL = repoURL
+        self.repoDir = repoDir
+        self.requirementsDir = requirementsDir
+        self.staged = staged
+
+    def run(self):
+        try:
+            # Staged updates are checked out next to the live repo, which stays untouched until the swap.
+            targetDir = prepare_staging(self.repoDir) if self.staged else self.repoDir
+            commitId = fetch_update(self.repoURL, targetDir)
+            # The requirement files come straight from the fetched commit, so packages can start before the checkout.
+            extract_requirements(targetDir, commitId, self.requirementsDir)
+            self.requirementsReadySignal.emit(self.requirementsDir, commitId.decode("ascii"))
+            checkout_update(targetDir, commitId)
+        except Exception as e:
+            logger.exception(e)
+            self.showErrorSignal.emit(f"An error occurred while updating the repository:\n{e}")
+            return
+        self.doneSignal.emit()
+
+class UpdateDialog(QtWidgets.QDialog):
+    # Shows every stage of the update at once: the git fetch/checkout, the package install running alongside it
+    # and, when a big wheel is needed, its download. Without gitUpdate only the packages are brought in line, for repoDir
+    # itself or, if staged, for the update that's already checked out in its staging directory (which is then swapped in).
+    def __init__(self, repoURL, repoDir, gitUpdate=True, staged=None):
+        super().__init__()
+        translationUpdater.bind(self.setWindowTitle, 'Update')
+        self.previous_percent_completed = -1
+        self.repoDir = repoDir
+        self.staged = repoData.get("staged_updates", False) if staged is None else staged
+        self.gitDone = not gitUpdate
+        self.packagesDone = False
+        self.packageThread = None
+        self.downloadThread = None
+        self.requirementsDir = tempfile.mkdtemp(prefix="update-requirements-")
+
+        self.layout = QtWidgets.QVBoxLayout()
+
+        self.gitLabel = QtWidgets.QLabel()
+        translationUpdater.bind(self.gitLabel.setText, "Updating Github repository...")
+        self.layout.addWidget(self.gitLabel)
+        self.gitProgress = QtWidgets.QProgressBar(self)
+        self.gitProgress.setRange(0, 0)
+        self.layout.addWidget(self.gitProgress)
+
+        self.label = QtWidgets.QLabel(translate_ui_text(normalInstallText))
+        self.layout.addWidget(self.label)
+        self.progress = QtWidgets.QProgressBar(self)
+        self.progress.setMaximum(100)
+        self.layout.addWidget(self.progress)
+        self.label.hide()
+        self.progress.hide()
+
+        self.downloadLabel = QtWidgets.QLabel()
+        self.layout.addWidget(self.downloadLabel)
+        self.downloadProgress = QtWidgets.QProgressBar(self)
+        self.layout.addWidget(self.downloadProgress)
+        self.downloadLabel.hide()
+        self.downloadProgress.hide()
+
+        self.setLayout(self.layout)
+
+        self.gitThread = None
+        if gitUpdate:
+            self.gitThread = GitUpdateThread(repoURL, repoDir, self.requirementsDir, self.staged)
+            self.gitThread.requirementsReadySignal.connect(self.start_packages)
+            self.gitThread.doneSignal.connect(self.git_done)
+            self.gitThread.showErrorSignal.connect(self.showErrorAndExit)
+        else:
+            self.gitLabel.hide()
+            self.gitProgress.hide()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.gitThread is not None:
+            self.gitThread.start()
+        elif self.packageThread is None and not self.packagesDone:
+            sourceDir = get_staging_dir(self.repoDir) if self.staged else self.repoDir
+            QtCore.QTimer.singleShot(0, lambda: self.start_packages(sourceDir, get_head_commit(sourceDir)))
+
+    def start_packages(self, requirementsDir, commit=""):
+        packages = filter_satisfied_requirements(check_requirements(requirementsDir))
+        # A commit we've installed before (or one that ships its own lock) skips resolving altogether.
+        lock = load_lock(requirementsDir, commit)
+        lockEntries = get_lock_changes(lock) if lock is not None else None
+        if (lockEntries is not None and len(lockEntries) == 0) or (lockEntries is None and len(packages) == 0):
+            self.packages_done()
+            return
+
+        self.label.show()
+        self.progress.show()
+        self.packageThread = PackageThread(packages, lockEntries)
+        self.packageThread.doneSignal.connect(self.packages_done)
+        self.packageThread.setLabelTextSignal.connect(self.setText)
+        self.packageThread.updateProgressSignal.connect(self.update_progress_bar)
+        self.packageThread.showErrorSignal.connect(self.showErrorAndExit)
+        self.packageThread.downloadSignal.connect(self.downloadFile)
+        self.packageThread.start()
+
+    def git_done(self):
+        if not self.staged:
+            # Already checked out in place, the app's bytecode can be compiled while the packages finish.
+            start_precompile(get_repo_sources(self.repoDir))
+        self.gitDone = True
+        self.gitProgress.setRange(0, 100)
+        self.gitProgress.setValue(100)
+        self.check_finished()
+
+    def packages_done(self):
+        self.packagesDone = True
+        self.check_finished()
+
+    def check_finished(self):
+        if self.gitDone and self.packagesDone:
+            shutil.rmtree(self.requirementsDir, ignore_errors=True)
+            if self.staged:
+                try:
+                    activate_staged_update(self.repoDir)
+                except OSError as e:
+                    logger.exception(e)
+                    self.showErrorAndExit(f"An error occurred while activating the update:\n{e}")
+                start_precompile(get_repo_sources(self.repoDir))
+            self.done(0)
+
+    def downloadFile(self, url, location, sha256):
+        # The file being downloaded, without the ".part" it has until it's done.
+        self.downloadName = os.path.splitext(os.path.basename(location))[0]
+        self.downloadLabel.setText(f"{translate_ui_text(downloadingText)} {self.downloadName}")
+        self.downloadProgress.setRange(0, 100)
+        self.downloadProgress.setValue(0)
+        self.downloadLabel.show()
+        self.downloadProgress.show()
+
+        # An empty hash means the index didn't publish one, the download is still hashed for the wheelhouse.
+        self.downloadThread = DownloadThread(url, location, sha256 or None)
+        self.downloadThread.setProgressBarTotalSignal.connect(self.set_download_progress_bar)
+        self.downloadThread.doneSignal.connect(lambda: self.download_finished(True))
+        self.downloadThread.failedSignal.connect(lambda error: self.download_finished(False, error))
+        self.downloadThread.labelTextSignal.connect(self.set_eta)
+        self.downloadThread.updateProgressSignal.connect(self.downloadProgress.setValue)
+        self.downloadThread.start()
+
+    def download_finished(self, succeeded:bool, error=None):
+        self.downloadLabel.hide()
+        self.downloadProgress.hide()
+        self.packageThread.downloadSucceeded = succeeded
+        self.packageThread.downloadedSha256 = self.downloadThread.sha256 if succeeded else None
+        self.packageThread.downloadError = error
+        self.packageThread.downloadDone.set()
+
+    def set_eta(self, ETASeconds, bytesPerSecond):
+        # The measured speed, so a download_limit_kbps cap shows up as such.
+        self.downloadLabel.setText(f"{translate_ui_text(downloadingText)} {self.downloadName} ({bytesPerSecond / 1024 / 1024:.1f} MB/s, {format_eta(ETASeconds)})")
+
+    def set_download_progress_bar(self, amount):
+        if amount == -1:
+            self.downloadProgress.setRange(0, 0)
+        else:
+            self.downloadProgress.setMaximum(100)
+
+    def showErrorAndExit(self, error):
+        logger.error(error)
+        QtWidgets.QMessageBox.critical(self, 'Error', error)
+        sys.exit(1)
+
+    def setText(self, newText:str):
+        if self.label.text() != newText:
+            self.label.setText(newText)
+
+    def update_progress_bar(self, percent_completed):
+        if percent_completed != self.previous_percent_completed:
+            self.progress.setValue(percent_completed)
+            self.previous_percent_completed = percent_completed
+
+    def closeEvent(self, event):
+        reply = QtWidgets.QMessageBox.question(
+            self,
+            translate_ui_text('Confirmation'),
+            translate_ui_text('Are you sure you want to quit?'),
+            QtWidgets.QMessageBox.StandardButton.Yes | QtWidgets.QMessageBox.StandardButton.No
+        )
+
+        if reply == QtWidgets.QMessageBox.StandardButton.Yes:
+            if self.downloadThread is not None:
+                # Let the download stop cleanly so it can be resumed next time.
+                self.downloadThread.cancel()
+                if not self.downloadThread.wait(5000):
+                    self.downloadThread.terminate()
+            if self.packageThread is not None:
+                self.packageThread.terminate()
+            if self.gitThread is not None:
+                self.gitThread.terminate()
+            event.accept()
+            app.exit(0)
+            sys.exit(0)
+        else:
+            event.ignore()
+
+app = QtWidgets.QApplication([])
+translationUpdater = TranslationUpdater()
+
+def run_update(repoURL, repoDir, gitUpdate=True, staged=None):
+    start_background_translation()
+    if "icon" in repoData:
+        app.setWindowIcon(QtGui.QIcon(repoData["icon"]))
+    app.setStyleSheet(get_stylesheet())
+
+    open("installing", 'w').close()
+    dialog = UpdateDialog(repoURL, repoDir, gitUpdate, staged)
+    QtCore.QTimer.singleShot(1, lambda: (dialog.activateWindow(), dialog.raise_()))
+    dialog.show()
+    with Span("update", git=gitUpdate):
+        app.exec()
+    save_requirements_state(repoDir)
+    write_lock_snapshot(repoDir)
+    os.remove("installing")
@@ -3,6 +3,7 @@ package main
 import (
 	"encoding/json"
 	"fmt"
+	"io"
 	"log"
 	"os"
 	"os/exec"
@@ -19,6 +20,9 @@ import (
 
 var pythonBinaryPath string
 
+// install.py exits with this code when it wants us to start the app through its watchdog instead of running it itself.
+const watchdogExitCode = 98
+
 type Config struct {
 	UsePythonW bool   `json:"use_pythonw"`
 	VenvFolder string `json:"venv_folder"`
@@ -200,13 +204,7 @@ func main() {
 	fmt.Println("Python Script Path: ", absPythonScriptPath)
 	fmt.Println("Venv Python Binary Path: ", absNewVenvPythonBinaryPath)
 
-	cmd := exec.Command(absNewVenvPythonBinaryPath, absPythonScriptPath)
-	cmd.Stderr = f
-
-	if runtime.GOOS == "windows" {
-		cmd.SysProcAttr = &syscall.SysProcAttr{HideWindow: true}
-	}
-	err = cmd.Run()
+	err = runInstallScript(absNewVenvPythonBinaryPath, absPythonScriptPath, f)
 	counter := 0
 	if err != nil {
 		exitError, ok := err.(*exec.ExitError) // type assert to *exec.ExitError
@@ -233,11 +231,7 @@ func main() {
 					}
 					os.Exit(1)
 				}
-				cmd = exec.Command(absNewVenvPythonBinaryPath, absPythonScriptPath)
-				if runtime.GOOS == "windows" {
-					cmd.SysProcAttr = &syscall.SysProcAttr{HideWindow: true}
-				}
-				err = cmd.Run()
+				err = runInstallScript(absNewVenvPythonBinaryPath, absPythonScriptPath, nil)
 				exitError, ok = err.(*exec.ExitError) // type assert to *exec.ExitError
 			}
 		} else {
@@ -249,6 +243,28 @@ func main() {
 
 }
 
+// runInstallScript runs install.py. If it hands the app launch back to us, the watchdog is started in its place so the
+// installer's memory is freed while the app runs. The watchdog's exit code follows the same protocol as install.py's.
+func runInstallScript(pythonPath string, scriptPath string, stderr io.Writer) error {
+	cmd := exec.Command(pythonPath, scriptPath)
+	cmd.Stderr = stderr
+	if runtime.GOOS == "windows" {
+		cmd.SysProcAttr = &syscall.SysProcAttr{HideWindow: true}
+	}
+	err := cmd.Run()
+
+	exitError, ok := err.(*exec.ExitError)
+	if ok && exitError.ExitCode() == watchdogExitCode {
+		cmd = exec.Command(pythonPath, scriptPath, "--watchdog")
+		cmd.Stderr = stderr
+		if runtime.GOOS == "windows" {
+			cmd.SysProcAttr = &syscall.SysProcAttr{HideWindow: true}
+		}
+		err = cmd.Run()
+	}
+	return err
+}
+
 func runMeElevated() {
 	runMeElevatedWithArg("")
 }
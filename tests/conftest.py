@@ -0,0 +1,26 @@
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+packageDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def install(tmp_path_factory):
+    # install.py sets itself up on import (logs dir, repo.json, prerequisite check), all relative to the working
+    # directory, so it gets imported from inside a throwaway install dir.
+    installDir = tmp_path_factory.mktemp("install")
+    with open(installDir / "repo.json", 'w') as f:
+        json.dump({"repo_url": "https://example.invalid/repo.git", "repo_dir": "repo", "startup_script": "main.py",
+                   "venv_folder": "venv", "download_connections": 3}, f)
+    previousDir = os.getcwd()
+    os.chdir(installDir)
+    sys.path.insert(0, packageDir)
+    try:
+        yield importlib.import_module("install")
+    finally:
+        sys.path.remove(packageDir)
+        os.chdir(previousDir)
@@ -0,0 +1,80 @@
+import hashlib
+import http.server
+import json
+import os
+import threading
+import time
+
+import pytest
+
+segmentSize = 6000
+fileData = os.urandom(segmentSize * 3)
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(fileData)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        start, end = self.headers["Range"].split("=")[1].split("-")
+        start, end = int(start), int(end)
+        # Give the hashing thread time to read what's already on disk before anything new gets written.
+        time.sleep(0.2)
+        self.send_response(206)
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(fileData)}")
+        self.end_headers()
+        for offset in range(start, end + 1, 1000):
+            self.wfile.write(fileData[offset:min(offset + 1000, end + 1)])
+            self.wfile.flush()
+            time.sleep(0.01)
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/file.bin"
+    httpd.shutdown()
+
+
+def test_resume_hashes_partial_segments(install, server, tmp_path):
+    location = str(tmp_path / "file.bin")
+    # Segment 0 finished, segments 1 and 2 interrupted partway through.
+    written = [segmentSize, 1000, 2500]
+    segments = [[i * segmentSize, (i + 1) * segmentSize - 1, written[i]] for i in range(3)]
+    data = bytearray(len(fileData))
+    for start, end, count in segments:
+        data[start:start + count] = fileData[start:start + count]
+    with open(location, 'wb') as f:
+        f.write(data)
+    with open(location + install.downloadManifestSuffix, 'w') as f:
+        json.dump({"url": server, "size": len(fileData), "segments": segments}, f)
+
+    expected = hashlib.sha256(fileData).hexdigest()
+    download = install.ResumableDownload(server, location, expectedSha256=expected, rateLimiter=install.TokenBucket())
+    download.minSegmentSize = segmentSize
+    download.run()
+
+    assert download.resumedBytes == sum(written)
+    assert download.sha256 == expected
+    with open(location, 'rb') as f:
+        assert f.read() == fileData
+    assert not os.path.exists(location + install.downloadManifestSuffix)
+
+
+def test_fresh_download_hash(install, server, tmp_path):
+    location = str(tmp_path / "file.bin")
+    download = install.ResumableDownload(server, location, rateLimiter=install.TokenBucket())
+    download.minSegmentSize = segmentSize
+    download.run()
+
+    assert download.sha256 == hashlib.sha256(fileData).hexdigest()
+    assert download.sha256 == install.hash_file(location)
@@ -0,0 +1,83 @@
+import base64
+import hashlib
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+
+def build_wheel(directory, name, version) -> str:
+    # A minimal pure-python wheel, so nothing has to come from an index.
+    distInfo = f"{name}-{version}.dist-info"
+    files = {
+        f"{name}.py": f"version = {version!r}\n",
+        f"{distInfo}/METADATA": f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n",
+        f"{distInfo}/WHEEL": "Wheel-Version: 1.0\nGenerator: tests\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+    }
+    record = ""
+    for path, content in files.items():
+        digest = base64.urlsafe_b64encode(hashlib.sha256(content.encode("utf-8")).digest()).rstrip(b"=").decode("ascii")
+        record += f"{path},sha256={digest},{len(content.encode('utf-8'))}\n"
+    files[f"{distInfo}/RECORD"] = record + f"{distInfo}/RECORD,,\n"
+
+    path = os.path.join(directory, f"{name}-{version}-py3-none-any.whl")
+    with zipfile.ZipFile(path, 'w') as archive:
+        for filename, content in files.items():
+            archive.writestr(filename, content)
+    return path
+
+
+@pytest.fixture(params=["pip", "uv"])
+def installer(request, install, tmp_path, monkeypatch):
+    # Each installer pointed at a throwaway venv instead of the interpreter running the tests.
+    if request.param == "uv":
+        uvPath = install.find_uv()
+        if uvPath is None:
+            pytest.skip("uv is not available")
+        monkeypatch.setenv("UV_CACHE_DIR", str(tmp_path / "uv-cache"))
+        installer = install.UvInstaller(uvPath)
+    else:
+        monkeypatch.setenv("PIP_NO_CACHE_DIR", "1")
+        installer = install.PipInstaller()
+    venvDir = tmp_path / "venv"
+    subprocess.run([sys.executable, "-m", "venv", str(venvDir)], check=True, capture_output=True)
+    venvPython = str(venvDir / ("Scripts/python.exe" if os.name == "nt" else "bin/python"))
+    monkeypatch.setattr(sys, "executable", venvPython)
+    return installer
+
+
+@pytest.fixture
+def wheels(install):
+    paths = {}
+    for version in ["1.0", "2.0"]:
+        path = build_wheel(install.wheelhouse.directory, "lockdemo", version)
+        install.wheelhouse.add(path)
+        paths[version] = path
+    return paths
+
+
+def installed_version(name):
+    return subprocess.run([sys.executable, "-c", f"import importlib.metadata; print(importlib.metadata.version({name!r}))"],
+                          check=True, capture_output=True, text=True).stdout.strip()
+
+
+def test_offline_install(install, installer, wheels):
+    installer.install([*install.wheelhouse.pip_args(), "lockdemo"], offline=True)
+    assert installed_version("lockdemo") == "2.0"
+
+
+def test_lock_reinstall(install, installer, wheels, monkeypatch):
+    if "QT_QPA_PLATFORM" not in os.environ:
+        monkeypatch.setenv("QT_QPA_PLATFORM", "offscreen")
+    install_ui = pytest.importorskip("install_ui")
+    monkeypatch.setattr(install_ui, "get_installer", lambda: installer)
+
+    installer.install([*install.wheelhouse.pip_args(), "lockdemo==2.0"], offline=True)
+    assert installed_version("lockdemo") == "2.0"
+
+    # Going back to the locked version: exact release, hash checked, no resolving.
+    entry = {"name": "lockdemo", "version": "1.0", "filename": os.path.basename(wheels["1.0"]), "sha256": install.hash_file(wheels["1.0"])}
+    assert install_ui.PackageThread([], [entry]).install_from_lock([entry])
+    assert installed_version("lockdemo") == "1.0"
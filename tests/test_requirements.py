@@ -0,0 +1,30 @@
+import os
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_marker_split_pins_are_all_kept(install, tmp_path):
+    write(tmp_path / "requirements.txt", 'numpy==1.26.4; python_version >= "3.9"\nnumpy==1.24.4; python_version < "3.9"\n')
+    install.clear_requirements_state()
+
+    assert install.check_requirements(str(tmp_path)) == ['numpy==1.26.4; python_version >= "3.9"', 'numpy==1.24.4; python_version < "3.9"']
+
+
+def test_changes_in_referenced_files_are_detected(install, tmp_path):
+    os.makedirs(tmp_path / "reqs")
+    write(tmp_path / "requirements.txt", "-r reqs/base.txt\n-c constraints.txt\nrequests\n")
+    write(tmp_path / "reqs" / "base.txt", "six\n")
+    write(tmp_path / "constraints.txt", "idna<4\n")
+    install.save_requirements_state(str(tmp_path))
+    assert install.check_requirements(str(tmp_path)) == []
+
+    # The nested file is relative to the file that references it, and its lines count as requirements.
+    write(tmp_path / "reqs" / "base.txt", "six\nattrs\n")
+    assert install.check_requirements(str(tmp_path)) == ["attrs"]
+    install.save_requirements_state(str(tmp_path))
+
+    write(tmp_path / "constraints.txt", "idna<3\n")
+    assert install.get_requirements_snapshot(str(tmp_path))["requirements_hash"] != install.load_requirements_state()["requirements_hash"]